@@ -9,8 +9,1162 @@
 
 # Tip: Consider which file modes will let you read and write text data.
 
+import codecs
+import errno
+import io
+import json
+import mmap
 import os
 import hashlib
+import platform
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import ctypes
+    libc = ctypes.CDLL(None, use_errno=True)
+except (ImportError, OSError):
+    libc = None
+
+# Buffer for the plain read/write fallback, allocated once per copy
+COPY_BUFFER_SIZE = 1024 * 1024
+# Largest request passed to copy_file_range/sendfile in one call
+KERNEL_COPY_SIZE = 1024 * 1024 * 1024
+# Batch copies: threads copying at once, and how many bytes of files may be in progress together
+COPY_WORKERS = min(32, (os.cpu_count() or 1) * 4)
+MAX_BYTES_IN_FLIGHT = 256 * 1024 * 1024
+# Segmented copies split one big file into segments copied by several threads at once
+SEGMENT_SIZE = 64 * 1024 * 1024
+SEGMENT_WORKERS = min(8, os.cpu_count() or 1)
+# Tree hashes split a file into leaves hashed on several threads, then hash the digests pairwise
+TREE_LEAF_SIZE = 4 * 1024 * 1024
+HASH_WORKERS = os.cpu_count() or 1
+# Tree copies keep a list of what was copied in the destination folder
+TREE_MANIFEST_NAME = ".copy_manifest.json"
+# Durable batch copies are flushed to disk and renamed into place this many files at a time
+DURABLE_GROUP_SIZE = 512
+# Resumable copies are done and checkpointed in chunks of this size
+RESUME_CHUNK_SIZE = 64 * 1024 * 1024
+# Delta copies compare blocks of this size. After a change, matching blocks are
+# searched for byte by byte for at most DELTA_SEARCH_LIMIT bytes, then block by block
+DELTA_BLOCK_SIZE = 16 * 1024
+DELTA_SEARCH_LIMIT = 1024 * 1024
+# Modulus of the Adler-32 checksum used as the rolling weak hash
+ADLER_MOD = 65521
+# Content hash -> copy already on disk, so identical files can be linked instead of copied
+DEDUP_INDEX_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'copy_dedup_index.json')
+MAX_DEDUP_ENTRIES = 10000
+LINK_METHODS = ('reflink', 'hardlink')
+# Rate-limited copies move at most this much per step (one step = one I/O operation)
+LIMITED_STEP_SIZE = 1024 * 1024
+# ioprio_set(2) system call numbers and values from <linux/ioprio.h>
+IOPRIO_SYSCALLS = {'x86_64': 251, 'i386': 289, 'i686': 289, 'aarch64': 30, 'arm64': 30}
+IOPRIO_WHO_PROCESS = 1
+IOPRIO_CLASS_IDLE = 3
+IOPRIO_CLASS_SHIFT = 13
+# Source digests remembered by the copy audit, keyed by path and checked against (inode, size, mtime)
+AUDIT_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'copy_audit_cache.json')
+MAX_AUDIT_ENTRIES = 10000
+COPY_SUFFIX = "_copy.txt"
+# Digests that can be computed while copying, in the order they are printed
+HASH_ALGORITHMS = ('blake2b', 'sha256', 'md5')
+# ioctl number of FICLONE from <linux/fs.h>: share the source's blocks (btrfs, XFS)
+FICLONE = 0x40049409
+# Errors meaning "this method does not work for these files", not a real I/O error
+UNSUPPORTED_ERRORS = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.ENOTTY,
+                      errno.EOPNOTSUPP, errno.ENOTSUP, errno.EBADF, errno.EPERM}
+
+def clone_file(source_fd, dest_fd):
+    """
+    Make the destination share the source's data blocks. Returns False when
+    the file system (or platform) cannot do it.
+    """
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dest_fd, FICLONE, source_fd)
+        return True
+    except OSError as e:
+        if e.errno in UNSUPPORTED_ERRORS:
+            return False
+        raise
+
+def kernel_copy(copy_function, source_fd, dest_fd):
+    """
+    Copy with copy_file_range or sendfile, which move the bytes inside the
+    kernel. Both advance the file offsets. Returns False (before anything
+    was copied) when the call is not supported for these files.
+    """
+    copied = 0
+    while True:
+        try:
+            sent = copy_function(source_fd, dest_fd, KERNEL_COPY_SIZE)
+        except OSError as e:
+            if copied == 0 and e.errno in UNSUPPORTED_ERRORS:
+                return False
+            raise
+        if sent == 0:
+            break
+        copied += sent
+    # Some special files (e.g. in /proc) claim a size but give 0 bytes this way
+    return copied > 0
+
+def buffer_copy(source_file, dest_fd, hashers=()):
+    """
+    Copy through one reused buffer, feeding each block to the hashers on the way.
+    """
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    while True:
+        length = source_file.readinto(buffer)
+        if not length:
+            break
+        for hasher in hashers:
+            hasher.update(view[:length])
+        written = 0
+        while written < length:
+            written += os.write(dest_fd, view[written:length])
+
+def is_sparse(info):
+    """
+    True when the file has fewer blocks allocated than its size needs, i.e. it has holes.
+    """
+    return info.st_size > 0 and info.st_blocks * 512 < info.st_size
+
+def data_extents(fd, size):
+    """
+    Yield (start, end) of the parts of a file that hold data, skipping its
+    holes. Without SEEK_DATA support the whole file is one extent.
+    """
+    if not hasattr(os, 'SEEK_DATA'):
+        if size:
+            yield 0, size
+        return
+    pos = 0
+    while pos < size:
+        try:
+            start = os.lseek(fd, pos, os.SEEK_DATA)
+        except OSError as e:
+            if e.errno == errno.ENXIO:
+                # Only a hole is left
+                return
+            if pos == 0 and e.errno in UNSUPPORTED_ERRORS:
+                yield 0, size
+                return
+            raise
+        end = min(os.lseek(fd, start, os.SEEK_HOLE), size)
+        if start >= end:
+            return
+        yield start, end
+        pos = end
+
+def hash_zeros(hashers, length):
+    """
+    Feed a hole (length zero bytes) to the hashers without reading it from disk.
+    """
+    zeros = memoryview(bytes(min(length, COPY_BUFFER_SIZE)))
+    while length > 0:
+        step = min(length, len(zeros))
+        for hasher in hashers:
+            hasher.update(zeros[:step])
+        length -= step
+
+def pwrite_all(fd, data, offset):
+    """
+    Write all of data at offset; a single pwrite may write less.
+    """
+    view = memoryview(data)
+    written = 0
+    while written < len(view):
+        written += os.pwrite(fd, view[written:], offset + written)
+
+def copy_range(source_fd, dest_fd, start, end, hashers=(), use_copy_range=True):
+    """
+    Copy bytes start..end to the same offsets, with copy_file_range when
+    nothing is hashed, otherwise with pread, hashing and pwrite. Returns
+    whether copy_file_range still works, for the caller to pass to the next
+    range so an unsupported call is only tried once.
+    """
+    use_copy_range = use_copy_range and not hashers and hasattr(os, 'copy_file_range')
+    offset = start
+    while offset < end:
+        if use_copy_range:
+            try:
+                sent = os.copy_file_range(source_fd, dest_fd, min(end - offset, KERNEL_COPY_SIZE), offset, offset)
+                if sent:
+                    offset += sent
+                    continue
+            except OSError as e:
+                if e.errno not in UNSUPPORTED_ERRORS:
+                    raise
+            use_copy_range = False
+            continue
+        data = os.pread(source_fd, min(end - offset, COPY_BUFFER_SIZE), offset)
+        if not data:
+            raise EOFError(f"File shrank while it was being copied (at byte {offset})")
+        for hasher in hashers:
+            hasher.update(data)
+        pwrite_all(dest_fd, data, offset)
+        offset += len(data)
+    return use_copy_range
+
+def sparse_copy(source_fd, dest_fd, size, hashers=()):
+    """
+    Copy only the data extents of a sparse file to the same offsets and
+    leave the holes unwritten, so the copy is sparse too. Holes are hashed
+    as zeros.
+    """
+    pos = 0
+    use_copy_range = True
+    for start, end in data_extents(source_fd, size):
+        hash_zeros(hashers, start - pos)
+        use_copy_range = copy_range(source_fd, dest_fd, start, end, hashers, use_copy_range)
+        pos = end
+    hash_zeros(hashers, size - pos)
+    # Extends the file without allocating, which makes the trailing hole
+    os.ftruncate(dest_fd, size)
+
+def hash_leaf(fd, start, end, algorithm):
+    hasher = hashlib.new(algorithm)
+    # Leaves and inner nodes are hashed with different prefixes so one can't pass for the other
+    hasher.update(b'\x00')
+    for offset in range(start, end, COPY_BUFFER_SIZE):
+        hasher.update(os.pread(fd, min(COPY_BUFFER_SIZE, end - offset), offset))
+    return hasher.digest()
+
+def tree_hash_file(filepath, algorithm='sha256', leaf_size=TREE_LEAF_SIZE, workers=HASH_WORKERS):
+    """
+    Hash a file as a Merkle tree: fixed-size leaves are hashed in a thread
+    pool (hashlib and pread release the GIL, so this uses several cores),
+    then neighbouring digests are hashed together level by level up to
+    one root. The root is not the same as the usual digest of the file;
+    use hash_file() where that is needed.
+    """
+    fd = os.open(filepath, os.O_RDONLY)
+    try:
+        size = os.fstat(fd).st_size
+        leaves = [(start, min(start + leaf_size, size)) for start in range(0, size, leaf_size)] or [(0, 0)]
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            level = list(executor.map(lambda leaf: hash_leaf(fd, *leaf, algorithm), leaves))
+    finally:
+        os.close(fd)
+
+    while len(level) > 1:
+        # An odd digest at the end moves up a level unchanged
+        level = [hashlib.new(algorithm, b'\x01' + b"".join(level[i:i + 2])).digest() if i + 1 < len(level)
+                 else level[i] for i in range(0, len(level), 2)]
+    return level[0].hex()
+
+def parse_algorithms(text, default=('md5',)):
+    """
+    Turn "sha256, md5" into ('sha256', 'md5'). Raises ValueError for unknown names.
+    """
+    algorithms = tuple(name.strip().lower() for name in text.replace(',', ' ').split())
+    for name in algorithms:
+        if name not in HASH_ALGORITHMS:
+            raise ValueError(f"Unknown hash algorithm '{name}' (choose from {', '.join(HASH_ALGORITHMS)})")
+    return algorithms or default
+
+def hash_file(filepath, algorithms=('md5',), drop_cache=False):
+    """
+    Compute several digests of a file in one read. With drop_cache the file
+    is flushed and evicted from the page cache first, so the bytes really
+    come from the disk, and each block read is evicted again afterwards.
+    """
+    hashers = {name: hashlib.new(name) for name in algorithms}
+    buffer = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(filepath, 'rb', buffering=0) as f:
+        fd = f.fileno()
+        drop_cache = drop_cache and hasattr(os, 'posix_fadvise')
+        if drop_cache:
+            os.fdatasync(fd)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_SEQUENTIAL)
+
+        info = os.fstat(fd)
+        if is_sparse(info):
+            # Holes are hashed as zeros without being read
+            pos = 0
+            for start, end in data_extents(fd, info.st_size):
+                hash_zeros(hashers.values(), start - pos)
+                for offset in range(start, end, COPY_BUFFER_SIZE):
+                    data = os.pread(fd, min(COPY_BUFFER_SIZE, end - offset), offset)
+                    for hasher in hashers.values():
+                        hasher.update(data)
+                    if drop_cache:
+                        os.posix_fadvise(fd, offset, len(data), os.POSIX_FADV_DONTNEED)
+                pos = end
+            hash_zeros(hashers.values(), info.st_size - pos)
+            return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+        offset = 0
+        while True:
+            length = f.readinto(buffer)
+            if not length:
+                break
+            for hasher in hashers.values():
+                hasher.update(view[:length])
+            if drop_cache:
+                os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+            offset += length
+    return {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+def new_rate_limit(bytes_per_second=None, operations_per_second=None):
+    """
+    Token buckets for one copy job, shared by all of its threads. The
+    buckets start empty so the rate holds from the first byte, and hold at
+    most one second of tokens, so a burst after a pause stays short.
+    """
+    return {
+        'lock': threading.Lock(),
+        'last': time.monotonic(),
+        'bytes': {'rate': bytes_per_second, 'tokens': 0},
+        'operations': {'rate': operations_per_second, 'tokens': 0},
+    }
+
+def throttle(limit, byte_count):
+    """
+    Take byte_count bytes and one operation from the buckets, sleeping
+    until the tokens have been earned. Buckets may go into debt, so a later
+    caller waits for the earlier ones too and the average rate is exact.
+    """
+    with limit['lock']:
+        now = time.monotonic()
+        elapsed = now - limit['last']
+        limit['last'] = now
+        wait = 0.0
+        for key, amount in (('bytes', byte_count), ('operations', 1)):
+            bucket = limit[key]
+            if not bucket['rate']:
+                continue
+            bucket['tokens'] = min(bucket['rate'], bucket['tokens'] + elapsed * bucket['rate']) - amount
+            if bucket['tokens'] < 0:
+                wait = max(wait, -bucket['tokens'] / bucket['rate'])
+    if wait:
+        time.sleep(wait)
+
+def lower_priority(nice_increment=10, idle_io=True):
+    """
+    Make this process (and the threads it starts from now on) yield the CPU
+    and, with idle_io, the disk to everything else. Cannot be undone
+    without privileges. Returns a description of what was changed.
+    """
+    changes = []
+    if nice_increment and hasattr(os, 'nice'):
+        changes.append(f"nice {os.nice(nice_increment)}")
+    syscall = IOPRIO_SYSCALLS.get(platform.machine())
+    if idle_io and libc is not None and syscall and platform.system() == 'Linux':
+        if libc.syscall(syscall, IOPRIO_WHO_PROCESS, 0, IOPRIO_CLASS_IDLE << IOPRIO_CLASS_SHIFT) == 0:
+            changes.append("idle I/O class")
+    return ", ".join(changes) or "unchanged"
+
+def drop_from_cache(fd, offset, length):
+    if hasattr(os, 'posix_fadvise'):
+        os.posix_fadvise(fd, offset, length, os.POSIX_FADV_DONTNEED)
+
+def limited_copy(source_fd, dest_fd, size, hashers=(), limit=None, drop_cache=False):
+    """
+    Copy in small steps, waiting on the rate limit before each one. With
+    drop_cache each copied range is dropped from the page cache; written
+    pages can only be dropped once they are on disk, so the range written
+    one step earlier is dropped again. Holes of a sparse file are skipped.
+    """
+    info = os.fstat(source_fd)
+    extents = data_extents(source_fd, size) if is_sparse(info) else [(0, size)]
+    step_size = LIMITED_STEP_SIZE
+    if limit and limit['bytes']['rate']:
+        # Smaller steps keep a low rate smooth
+        step_size = max(64 * 1024, min(step_size, int(limit['bytes']['rate'] / 10)))
+    use_copy_range = True
+    previous = None
+    pos = 0
+    for start, end in extents:
+        hash_zeros(hashers, start - pos)
+        offset = start
+        while offset < end:
+            count = min(step_size, end - offset)
+            if limit:
+                throttle(limit, count)
+            use_copy_range = copy_range(source_fd, dest_fd, offset, offset + count, hashers, use_copy_range)
+            if drop_cache:
+                drop_from_cache(source_fd, offset, count)
+                drop_from_cache(dest_fd, offset, count)
+                if previous:
+                    drop_from_cache(dest_fd, *previous)
+                previous = (offset, count)
+            offset += count
+        pos = end
+    hash_zeros(hashers, size - pos)
+    os.ftruncate(dest_fd, size)
+
+def break_hard_link(dest_path, keep_data=False):
+    """
+    Call before writing into dest_path. When it is hard-linked (e.g. by a
+    deduplicating copy) writing in place would change every linked file,
+    so it is unlinked first, or with keep_data replaced by a private copy
+    of itself (for writers that reuse the old contents).
+    """
+    try:
+        info = os.stat(dest_path)
+    except FileNotFoundError:
+        return
+    if info.st_nlink <= 1:
+        return
+    if not keep_data:
+        os.remove(dest_path)
+        return
+    temp_path = f"{dest_path}.{os.getpid()}.tmp"
+    try:
+        copy_file_data(dest_path, temp_path)
+        os.chmod(temp_path, info.st_mode & 0o7777)
+        os.utime(temp_path, ns=(info.st_atime_ns, info.st_mtime_ns))
+        os.replace(temp_path, dest_path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def copy_file_data(source_path, dest_path, algorithms=(), limit=None, drop_cache=False):
+    """
+    Copy the bytes of source_path to dest_path using the cheapest method
+    that works: reflink, then copy_file_range, then sendfile, then a
+    read/write loop with one reused buffer. When algorithms are given the
+    source is hashed while it is copied, which needs the read/write loop.
+    A sparse source (one with holes) that cannot be reflinked is copied
+    extent by extent so the copy keeps its holes. With a rate limit (see
+    new_rate_limit) or drop_cache the copy is done in small throttled steps.
+    Returns (method used, {algorithm: hex digest}).
+    """
+    hashers = {name: hashlib.new(name) for name in algorithms}
+    break_hard_link(dest_path)
+    with open(source_path, 'rb', buffering=0) as source_file:
+        with open(dest_path, 'wb', buffering=0) as dest_file:
+            source_fd = source_file.fileno()
+            dest_fd = dest_file.fileno()
+            info = os.fstat(source_fd)
+            # Empty and special files (size 0) always go through the buffer
+            kernel_ok = not hashers and info.st_size > 0
+
+            if kernel_ok and clone_file(source_fd, dest_fd):
+                return 'reflink', {}
+            if (limit or drop_cache) and info.st_size > 0:
+                limited_copy(source_fd, dest_fd, info.st_size, list(hashers.values()), limit, drop_cache)
+                return 'rate limited', {name: hasher.hexdigest() for name, hasher in hashers.items()}
+            if is_sparse(info):
+                sparse_copy(source_fd, dest_fd, info.st_size, list(hashers.values()))
+                return 'sparse', {name: hasher.hexdigest() for name, hasher in hashers.items()}
+            if kernel_ok and hasattr(os, 'copy_file_range') and kernel_copy(
+                    os.copy_file_range, source_fd, dest_fd):
+                return 'copy_file_range', {}
+            if kernel_ok and hasattr(os, 'sendfile') and kernel_copy(
+                    lambda src, dst, count: os.sendfile(dst, src, None, count), source_fd, dest_fd):
+                return 'sendfile', {}
+            buffer_copy(source_file, dest_fd, list(hashers.values()))
+    return 'read/write', {name: hasher.hexdigest() for name, hasher in hashers.items()}
+
+def copy_files_parallel(filenames, workers=COPY_WORKERS, max_bytes_in_flight=MAX_BYTES_IN_FLIGHT,
+                        limit=None, drop_cache=False):
+    """
+    Copy each file to <name>_copy.txt as raw bytes using a pool of threads.
+    A copy only starts when the files already being copied add up to less
+    than max_bytes_in_flight (a file bigger than that runs on its own).
+    limit and drop_cache are passed on to copy_file_data for every file.
+    Yields (filename, output filename, error message or None) in input order.
+    """
+    in_flight = 0
+    budget = threading.Condition()
+
+    def copy_one(filename):
+        nonlocal in_flight
+        if not os.path.isfile(filename):
+            return filename, None, "File not found"
+        output_filename = f"{filename}_copy.txt"
+        size = min(os.path.getsize(filename), max_bytes_in_flight)
+        with budget:
+            budget.wait_for(lambda: in_flight == 0 or in_flight + size <= max_bytes_in_flight)
+            in_flight += size
+        try:
+            copy_file_data(filename, output_filename, limit=limit, drop_cache=drop_cache)
+            return filename, output_filename, None
+        except Exception as e:
+            return filename, None, f"Error - {e}"
+        finally:
+            with budget:
+                in_flight -= size
+                budget.notify_all()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(copy_one, filenames)
+
+def manifest_path(dest_path):
+    return dest_path + ".manifest.json"
+
+def load_manifest(path):
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+
+def save_manifest(manifest, path):
+    """
+    Write the manifest next to the copy. It is replaced in one step so a
+    crash never leaves half a manifest behind.
+    """
+    temp_path = path + ".tmp"
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+def chunked_digest(chunk_digests, algorithm='sha256'):
+    """
+    Digest of the whole file made from the digests of its chunks, in order.
+    """
+    return hashlib.new(algorithm, b"".join(bytes.fromhex(digest) for digest in chunk_digests)).hexdigest()
+
+def copy_file_resumable(source_path, dest_path, chunk_size=RESUME_CHUNK_SIZE, algorithm='sha256', progress=None):
+    """
+    Copy a large file chunk by chunk. After each chunk is safely on disk its
+    digest is added to a sidecar manifest (<dest>.manifest.json). When a
+    copy of the same, unchanged source was interrupted, the chunks listed
+    there are checked against the destination and the copy goes on from the
+    first missing or damaged one. progress(done, total) is called after
+    each chunk. Returns (digest built from the chunk digests, chunks
+    resumed, chunks copied); the manifest is removed when the copy finishes.
+    """
+    info = os.stat(source_path)
+    path = manifest_path(dest_path)
+    identity = {
+        'source': os.path.abspath(source_path),
+        'size': info.st_size,
+        'mtime_ns': info.st_mtime_ns,
+        'chunk_size': chunk_size,
+        'algorithm': algorithm,
+    }
+    manifest = load_manifest(path)
+    if manifest is None or {key: manifest.get(key) for key in identity} != identity:
+        manifest = dict(identity, chunks=[])
+
+    chunk_count = -(-info.st_size // chunk_size)
+    chunks = manifest['chunks']
+    break_hard_link(dest_path, keep_data=True)
+    with open(source_path, 'rb', buffering=0) as source_file:
+        fd = os.open(dest_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            # Keep only the leading chunks that are still intact in the destination
+            resumed = 0
+            while resumed < len(chunks):
+                data = os.pread(fd, chunk_size, resumed * chunk_size)
+                expected = min(chunk_size, info.st_size - resumed * chunk_size)
+                if len(data) != expected or hashlib.new(algorithm, data).hexdigest() != chunks[resumed]:
+                    break
+                resumed += 1
+            del chunks[resumed:]
+
+            for index in range(resumed, chunk_count):
+                data = os.pread(source_file.fileno(), chunk_size, index * chunk_size)
+                pwrite_all(fd, data, index * chunk_size)
+                os.fdatasync(fd)
+                chunks.append(hashlib.new(algorithm, data).hexdigest())
+                save_manifest(manifest, path)
+                if progress:
+                    progress(index + 1, chunk_count)
+
+            os.ftruncate(fd, info.st_size)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # An empty source has no chunks, so no manifest was ever written
+    if os.path.exists(path):
+        os.remove(path)
+    return chunked_digest(chunks, algorithm), resumed, chunk_count - resumed
+
+def strong_hash(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+def roll_adler32(checksum, out_byte, in_byte, block_size):
+    """
+    Adler-32 of the window moved one byte forward, from the old checksum.
+    """
+    a = (checksum & 0xFFFF) - out_byte + in_byte
+    b = (checksum >> 16) - block_size * out_byte + a - 1
+    return (b % ADLER_MOD) << 16 | a % ADLER_MOD
+
+def block_signatures(path, block_size=DELTA_BLOCK_SIZE):
+    """
+    Read the existing copy once and return (list of (weak, strong) per block,
+    {weak: {strong: block index}} for the full blocks).
+    """
+    blocks = []
+    lookup = {}
+    with open(path, 'rb') as f:
+        for index, block in enumerate(iter(lambda: f.read(block_size), b"")):
+            weak, strong = zlib.adler32(block), strong_hash(block)
+            blocks.append((weak, strong))
+            if len(block) == block_size:
+                lookup.setdefault(weak, {}).setdefault(strong, index)
+    return blocks, lookup
+
+def write_range(fd, mapped, start, end):
+    for pos in range(start, end, COPY_BUFFER_SIZE):
+        pwrite_all(fd, mapped[pos:min(pos + COPY_BUFFER_SIZE, end)], pos)
+
+def copy_file_delta(source_path, dest_path, block_size=DELTA_BLOCK_SIZE):
+    """
+    Bring an existing copy up to date like rsync --inplace does. Blocks of
+    the old copy are found in the source with a rolling Adler-32 and
+    confirmed with BLAKE2b. A block found at its old offset is left alone;
+    everything else is written from the source. A block found at another
+    offset (data moved by an insert or delete) must still be written at
+    its new place, and is reported as 'moved'.
+    Returns {'size', 'written', 'unchanged', 'moved'} in bytes.
+    """
+    size = os.path.getsize(source_path)
+    if not os.path.exists(dest_path):
+        copy_file_data(source_path, dest_path)
+        return {'size': size, 'written': size, 'unchanged': 0, 'moved': 0}
+
+    break_hard_link(dest_path, keep_data=True)
+    old_blocks, lookup = block_signatures(dest_path, block_size)
+    result = {'size': size, 'written': 0, 'unchanged': 0, 'moved': 0}
+    fd = os.open(dest_path, os.O_RDWR)
+    try:
+        if size:
+            with open(source_path, 'rb') as source_file:
+                with mmap.mmap(source_file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    # Bytes from dirty_start up to pos still have to be written
+                    dirty_start = 0
+                    pos = 0
+                    weak = None
+                    searched = 0
+                    while pos + block_size <= size:
+                        if weak is None:
+                            weak = zlib.adler32(mapped[pos:pos + block_size])
+                        index = None
+                        if weak in lookup:
+                            index = lookup[weak].get(strong_hash(mapped[pos:pos + block_size]))
+                        if index is not None:
+                            old_index, remainder = divmod(pos, block_size)
+                            same_place = remainder == 0 and old_index < len(old_blocks) and \
+                                old_blocks[old_index] == old_blocks[index]
+                            if same_place:
+                                write_range(fd, mapped, dirty_start, pos)
+                                result['written'] += pos - dirty_start
+                                result['unchanged'] += block_size
+                                dirty_start = pos + block_size
+                            else:
+                                result['moved'] += block_size
+                            pos += block_size
+                            weak = None
+                            searched = 0
+                        elif searched < DELTA_SEARCH_LIMIT and pos + block_size < size:
+                            weak = roll_adler32(weak, mapped[pos], mapped[pos + block_size], block_size)
+                            pos += 1
+                            searched += 1
+                        else:
+                            pos += block_size
+                            weak = None
+
+                    # The short last block can only match the old last block in the same place
+                    old_index, remainder = divmod(pos, block_size)
+                    if (pos < size and remainder == 0 and old_index == len(old_blocks) - 1
+                            and old_blocks[old_index][1] == strong_hash(mapped[pos:size])):
+                        result['unchanged'] += size - pos
+                        size_to_write = pos
+                    else:
+                        size_to_write = size
+                    write_range(fd, mapped, dirty_start, size_to_write)
+                    result['written'] += max(0, size_to_write - dirty_start)
+        os.ftruncate(fd, size)
+    finally:
+        os.close(fd)
+    return result
+
+def load_index(index_file=DEDUP_INDEX_FILE):
+    try:
+        with open(index_file, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_index(index, index_file=DEDUP_INDEX_FILE, max_entries=MAX_DEDUP_ENTRIES):
+    """
+    Write a JSON index (dedup store or audit cache), dropping the least
+    recently used entries beyond max_entries.
+    """
+    if len(index) > max_entries:
+        oldest_first = sorted(index, key=lambda key: index[key]['used'])
+        for key in oldest_first[:len(index) - max_entries]:
+            del index[key]
+
+    os.makedirs(os.path.dirname(index_file) or '.', exist_ok=True)
+    temp_file = f"{index_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as f:
+        json.dump(index, f)
+    os.replace(temp_file, index_file)
+
+def find_stored_copy(index, digest):
+    """
+    Path of a stored copy with this content, or None. Entries whose file
+    was deleted or changed since it was stored are dropped.
+    """
+    entry = index.get(digest)
+    if entry is None:
+        return None
+    try:
+        info = os.stat(entry['path'])
+    except FileNotFoundError:
+        info = None
+    if info is None or (info.st_ino, info.st_size, info.st_mtime_ns) != (entry['inode'], entry['size'], entry['mtime_ns']):
+        del index[digest]
+        return None
+    entry['used'] = time.time()
+    return entry['path']
+
+def link_copy(stored_path, dest_path, link):
+    """
+    Make dest_path a reflink or a hard link of stored_path. Returns False
+    when the file system cannot do it.
+    """
+    if link == 'hardlink':
+        temp_path = f"{dest_path}.{os.getpid()}.tmp"
+        try:
+            os.link(stored_path, temp_path)
+        except OSError as e:
+            if e.errno in UNSUPPORTED_ERRORS:
+                return False
+            raise
+        os.replace(temp_path, dest_path)
+        return True
+
+    break_hard_link(dest_path)
+    with open(stored_path, 'rb') as stored_file:
+        with open(dest_path, 'wb') as dest_file:
+            return clone_file(stored_file.fileno(), dest_file.fileno())
+
+def copy_file_dedup(source_path, dest_path, index, link='reflink'):
+    """
+    Copy a file, but when a copy with the same BLAKE2b content hash is in
+    the index, make dest_path a reflink (shared blocks, still a separate
+    file) or hard link (the same file: changing one changes both) of it.
+    New content is copied normally and added to the index.
+    Returns (method used, bytes saved).
+    """
+    stored_path = None
+    # Content can only be stored already if a stored copy has the same size;
+    # otherwise the source is hashed while it is copied, in a single read
+    size = os.path.getsize(source_path)
+    if any(entry['size'] == size for entry in index.values()):
+        digest = hash_file(source_path, ('blake2b',))['blake2b']
+        stored_path = find_stored_copy(index, digest)
+        if stored_path is not None:
+            same_file = os.path.exists(dest_path) and os.path.samefile(stored_path, dest_path)
+            if same_file or link_copy(stored_path, dest_path, link):
+                return link, os.path.getsize(stored_path)
+        method, _ = copy_file_data(source_path, dest_path)
+    else:
+        method, digests = copy_file_data(source_path, dest_path, ('blake2b',))
+        digest = digests['blake2b']
+
+    info = os.stat(dest_path)
+    if stored_path is None:
+        index[digest] = {
+            'path': os.path.abspath(dest_path),
+            'inode': info.st_ino,
+            'size': info.st_size,
+            'mtime_ns': info.st_mtime_ns,
+            'used': time.time(),
+        }
+    return method, 0
+
+def preallocate(fd, size):
+    """
+    Reserve the space for the whole file up front so parallel writers do
+    not fragment it. Falls back to just setting the size.
+    """
+    if size and hasattr(os, 'posix_fallocate'):
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except OSError as e:
+            if e.errno not in UNSUPPORTED_ERRORS:
+                raise
+    os.ftruncate(fd, size)
+
+def copy_segment(source_fd, dest_fd, start, end, algorithm=None):
+    """
+    Copy bytes start..end at the same offsets with copy_range. Returns the
+    segment's hex digest, or None without an algorithm.
+    """
+    hasher = hashlib.new(algorithm) if algorithm else None
+    copy_range(source_fd, dest_fd, start, end, (hasher,) if hasher else ())
+    return hasher.hexdigest() if hasher else None
+
+def copy_file_segmented(source_path, dest_path, segment_size=SEGMENT_SIZE, workers=SEGMENT_WORKERS,
+                        algorithm=None):
+    """
+    Copy one large file as fixed-size segments in a pool of threads, each
+    reading and writing its own offsets. The destination is preallocated
+    first. With an algorithm each segment is hashed as it is copied and
+    the result is the digest of the segment digests (the same chunked
+    digest the resumable copy gives for the same chunk size); otherwise None.
+    """
+    source_fd = os.open(source_path, os.O_RDONLY)
+    try:
+        size = os.fstat(source_fd).st_size
+        break_hard_link(dest_path)
+        dest_fd = os.open(dest_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            preallocate(dest_fd, size)
+            segments = [(start, min(start + segment_size, size)) for start in range(0, size, segment_size)]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                digests = list(executor.map(lambda segment: copy_segment(source_fd, dest_fd, *segment, algorithm),
+                                            segments))
+        finally:
+            os.close(dest_fd)
+    finally:
+        os.close(source_fd)
+    return chunked_digest(digests, algorithm) if algorithm else None
+
+def scan_tree(root, skip_dir=None):
+    """
+    Yield (relative path, DirEntry) for every directory, file and symlink
+    under root, parents before children. skip_dir (e.g. a destination
+    inside the source) is not entered.
+    """
+    pending = ['']
+    while pending:
+        relative_dir = pending.pop()
+        with os.scandir(os.path.join(root, relative_dir)) as entries:
+            for entry in entries:
+                relative_path = os.path.join(relative_dir, entry.name)
+                if entry.is_dir(follow_symlinks=False):
+                    if skip_dir and os.path.realpath(entry.path) == skip_dir:
+                        continue
+                    pending.append(relative_path)
+                yield relative_path, entry
+
+def copy_tree(source_dir, dest_dir, workers=COPY_WORKERS, algorithm='blake2b'):
+    """
+    Copy a directory tree with a pool of threads, keeping file modes and
+    modification times. A manifest of relative paths, sizes, mtimes and
+    digests is written to dest_dir. On a later run a file is skipped when
+    the source still has the size and mtime in the manifest and the copy
+    is still there with the same size and mtime.
+    Returns {'copied', 'skipped', 'bytes', 'failed': [(path, error)]}.
+    """
+    os.makedirs(dest_dir, exist_ok=True)
+    path = os.path.join(dest_dir, TREE_MANIFEST_NAME)
+    old_manifest = load_manifest(path) or {}
+    manifest = {}
+    result = {'copied': 0, 'skipped': 0, 'bytes': 0, 'failed': []}
+    lock = threading.Lock()
+    directories = []
+
+    def copy_one(item):
+        relative_path, info = item
+        target = os.path.join(dest_dir, relative_path)
+        entry = old_manifest.get(relative_path)
+        try:
+            if entry and (entry['size'], entry['mtime_ns']) == (info.st_size, info.st_mtime_ns):
+                target_info = os.stat(target)
+                if (target_info.st_size, target_info.st_mtime_ns) == (info.st_size, info.st_mtime_ns):
+                    with lock:
+                        manifest[relative_path] = entry
+                        result['skipped'] += 1
+                    return
+        except FileNotFoundError:
+            pass
+        try:
+            # A read-only or hard-linked old copy is replaced, not written into
+            if os.path.lexists(target):
+                os.remove(target)
+            _, digests = copy_file_data(os.path.join(source_dir, relative_path), target, (algorithm,))
+            os.chmod(target, info.st_mode & 0o7777)
+            os.utime(target, ns=(info.st_atime_ns, info.st_mtime_ns))
+            with lock:
+                manifest[relative_path] = {'size': info.st_size, 'mtime_ns': info.st_mtime_ns,
+                                           'digest': f"{algorithm}:{digests[algorithm]}"}
+                result['copied'] += 1
+                result['bytes'] += info.st_size
+        except Exception as e:
+            with lock:
+                result['failed'].append((relative_path, str(e)))
+
+    def files():
+        for relative_path, entry in scan_tree(source_dir, os.path.realpath(dest_dir)):
+            target = os.path.join(dest_dir, relative_path)
+            if relative_path == TREE_MANIFEST_NAME:
+                continue
+            try:
+                if entry.is_symlink():
+                    if os.path.lexists(target):
+                        os.remove(target)
+                    os.symlink(os.readlink(entry.path), target)
+                elif entry.is_dir():
+                    os.makedirs(target, exist_ok=True)
+                    directories.append((target, entry.stat()))
+                elif entry.is_file():
+                    yield relative_path, entry.stat()
+            except OSError as e:
+                with lock:
+                    result['failed'].append((relative_path, str(e)))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for _ in executor.map(copy_one, files()):
+            pass
+
+    # Copying files into a directory changes its mtime, so directories come last, deepest first
+    for target, info in reversed(directories):
+        os.chmod(target, info.st_mode & 0o7777)
+        os.utime(target, ns=(info.st_atime_ns, info.st_mtime_ns))
+    save_manifest(manifest, path)
+    return result
+
+def transcode_file(source_path, dest_path, source_encoding='utf-8', target_encoding='utf-8',
+                   translate_newlines=True, chunk_size=COPY_BUFFER_SIZE):
+    """
+    Copy a text file chunk by chunk with incremental codecs, so memory stays
+    flat however big it is. Converts from source_encoding to target_encoding
+    and, with translate_newlines, turns \r\n and \r into \n like open()
+    in text mode does. A character or \r\n split between two chunks is
+    kept by the decoder until the next chunk completes it.
+    Returns {'lines', 'words', 'chars', 'converted_newlines'} of the text.
+    """
+    decoder = codecs.getincrementaldecoder(source_encoding)('strict')
+    if translate_newlines:
+        decoder = io.IncrementalNewlineDecoder(decoder, translate=True)
+    encoder = codecs.getincrementalencoder(target_encoding)('strict')
+    result = {'lines': 1, 'words': 0, 'chars': 0, 'converted_newlines': False}
+    last_is_word = False
+
+    break_hard_link(dest_path)
+    with open(source_path, 'rb') as source_file:
+        with open(dest_path, 'wb') as dest_file:
+            for chunk in iter(lambda: source_file.read(chunk_size), b""):
+                text = decoder.decode(chunk)
+                if text:
+                    # A word split between chunks is only counted once
+                    result['words'] += len(text.split()) - (last_is_word and not text[0].isspace())
+                    last_is_word = not text[-1].isspace()
+                    result['lines'] += text.count('\n')
+                    result['chars'] += len(text)
+                dest_file.write(encoder.encode(text))
+            text = decoder.decode(b"", final=True)
+            if text:
+                result['words'] += len(text.split()) - (last_is_word and not text[0].isspace())
+                result['lines'] += text.count('\n')
+                result['chars'] += len(text)
+            dest_file.write(encoder.encode(text, final=True))
+
+    seen = decoder.newlines if translate_newlines else None
+    result['converted_newlines'] = seen is not None and seen != '\n'
+    return result
+
+def sync_filesystem(fd):
+    """
+    Flush everything written to the file system holding fd with one
+    syncfs() call. Returns False where syncfs is not available.
+    """
+    if libc is None or not hasattr(libc, 'syncfs'):
+        return False
+    if libc.syncfs(fd) != 0:
+        error = ctypes.get_errno()
+        if error in UNSUPPORTED_ERRORS:
+            return False
+        raise OSError(error, os.strerror(error))
+    return True
+
+def fsync_path(path, data_only=False):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        if data_only:
+            os.fdatasync(fd)
+        else:
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def copy_files_durable(filenames, group_size=DURABLE_GROUP_SIZE, workers=COPY_WORKERS, per_file=False):
+    """
+    Copy files to <name>_copy.txt so that every reported copy survives a
+    power cut, and a copy is never seen half written. Each copy goes to a
+    temporary file first. Then, for a whole group of files at once, the
+    data is flushed (one syncfs per file system, or fdatasync of every file
+    in parallel without it), the files are renamed into place and each
+    directory involved is fsync'ed once. per_file=True does fsync, rename
+    and directory fsync for each file separately instead, for comparison.
+    Yields (filename, output filename, error message or None) in input order.
+    A file that could not be flushed or renamed is reported with its error.
+    """
+    def discard(temp_path):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def stage(item):
+        index, filename = item
+        if not os.path.isfile(filename):
+            return [filename, None, None, "File not found"]
+        output_filename = f"{filename}_copy.txt"
+        # The index keeps temp files apart when a name is listed twice
+        temp_path = f"{output_filename}.{os.getpid()}.{index}.tmp"
+        try:
+            copy_file_data(filename, temp_path)
+            if per_file:
+                fsync_path(temp_path)
+                os.replace(temp_path, output_filename)
+                fsync_path(os.path.dirname(os.path.abspath(output_filename)))
+            return [filename, output_filename, temp_path, None]
+        except Exception as e:
+            discard(temp_path)
+            return [filename, None, None, f"Error - {e}"]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for group_start in range(0, len(filenames), group_size):
+            group = enumerate(filenames[group_start:group_start + group_size], group_start)
+            staged = list(executor.map(stage, group))
+            ready = [item for item in staged if item[3] is None]
+
+            if ready and not per_file:
+                try:
+                    devices = {}
+                    for _, _, temp_path, _ in ready:
+                        devices.setdefault(os.stat(temp_path).st_dev, []).append(temp_path)
+                    for temp_paths in devices.values():
+                        fd = os.open(temp_paths[0], os.O_RDONLY)
+                        try:
+                            synced = sync_filesystem(fd)
+                        finally:
+                            os.close(fd)
+                        if not synced:
+                            list(executor.map(lambda path: fsync_path(path, data_only=True), temp_paths))
+                except Exception as e:
+                    # Nothing of this group has been renamed yet
+                    for item in ready:
+                        discard(item[2])
+                        item[1], item[3] = None, f"Error - {e}"
+                    ready = []
+
+                directories = {}
+                for item in ready:
+                    try:
+                        os.replace(item[2], item[1])
+                    except OSError as e:
+                        discard(item[2])
+                        item[1], item[3] = None, f"Error - {e}"
+                        continue
+                    directories.setdefault(os.path.dirname(os.path.abspath(item[1])), []).append(item)
+                for directory, items in directories.items():
+                    try:
+                        fsync_path(directory)
+                    except OSError as e:
+                        for item in items:
+                            item[3] = f"Error - copied but the rename was not flushed to disk: {e}"
+
+            for filename, output_filename, _, error in staged:
+                yield filename, output_filename, error
+
+def find_copy_pairs(directory):
+    """
+    Find every <name>_copy.txt under directory and pair it with <name>.
+    Returns (list of (original, copy), list of copies whose original is gone).
+    """
+    pairs = []
+    orphans = []
+    for relative_path, entry in scan_tree(directory):
+        if entry.name.endswith(COPY_SUFFIX) and entry.is_file(follow_symlinks=False):
+            original = entry.path[:-len(COPY_SUFFIX)]
+            if os.path.isfile(original):
+                pairs.append((original, entry.path))
+            else:
+                orphans.append(entry.path)
+    pairs.sort()
+    orphans.sort()
+    return pairs, orphans
+
+def audit_copies(pairs, cache, workers=HASH_WORKERS, algorithm='blake2b'):
+    """
+    Check that each copy still matches its original without copying
+    anything. Sizes are compared first, so a truncated copy fails without
+    being read. Then the copies and the originals not found in the cache
+    are all hashed in one thread pool. An original's digest is reused
+    while its inode, size and mtime are unchanged; entries are only
+    written once their digest is known, so an interrupted audit never
+    leaves a half-filled entry behind.
+    Returns ({'ok', 'mismatched', 'failed', 'bytes_hashed', 'cache_hits'},
+    list of (original, copy, problem)).
+    """
+    summary = {'ok': 0, 'mismatched': 0, 'failed': 0, 'bytes_hashed': 0, 'cache_hits': 0}
+    problems = []
+    to_compare = []
+    to_hash = set()
+    pending = {}
+    for original, copy in pairs:
+        try:
+            original_info, copy_info = os.stat(original), os.stat(copy)
+        except OSError as e:
+            summary['failed'] += 1
+            problems.append((original, copy, str(e)))
+            continue
+        if original_info.st_size != copy_info.st_size:
+            summary['mismatched'] += 1
+            problems.append((original, copy, f"size differs ({original_info.st_size} vs {copy_info.st_size} bytes)"))
+            continue
+
+        key = os.path.abspath(original)
+        entry = cache.get(key)
+        if entry is not None and entry.get('digest') is not None and entry['algorithm'] == algorithm and \
+                (entry['inode'], entry['size'], entry['mtime_ns']) == \
+                (original_info.st_ino, original_info.st_size, original_info.st_mtime_ns):
+            entry['used'] = time.time()
+            summary['cache_hits'] += 1
+        else:
+            pending[key] = {'algorithm': algorithm, 'inode': original_info.st_ino, 'size': original_info.st_size,
+                            'mtime_ns': original_info.st_mtime_ns}
+            to_hash.add(original)
+        to_hash.add(copy)
+        to_compare.append((original, copy))
+
+    def hash_one(path):
+        try:
+            return path, hash_file(path, (algorithm,))[algorithm], None
+        except OSError as e:
+            return path, None, str(e)
+
+    digests = {}
+    errors = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, digest, error in executor.map(hash_one, sorted(to_hash)):
+            if error:
+                errors[path] = error
+            else:
+                digests[path] = digest
+                summary['bytes_hashed'] += os.path.getsize(path)
+
+    for original, copy in to_compare:
+        key = os.path.abspath(original)
+        if key in pending and original in digests:
+            cache[key] = dict(pending.pop(key), digest=digests[original], used=time.time())
+        error = errors.get(original) or errors.get(copy)
+        if error:
+            summary['failed'] += 1
+            problems.append((original, copy, error))
+        elif cache[key]['digest'] == digests[copy]:
+            summary['ok'] += 1
+        else:
+            summary['mismatched'] += 1
+            problems.append((original, copy, "content differs"))
+    return summary, problems
 
 def copy_file_simple():
     print("=" * 60)
@@ -30,13 +1184,14 @@ def copy_file_simple():
         return
     
     try:
-        with open(filename, 'r', encoding='utf-8') as source_file:
-            content = source_file.read()
+        source_encoding = input("Encoding of the file (Enter for utf-8): ").strip() or 'utf-8'
+        target_encoding = input("Encoding of the copy (Enter for utf-8): ").strip() or 'utf-8'
+        codecs.lookup(source_encoding)
+        codecs.lookup(target_encoding)
 
         output_filename = f"{filename}_copy.txt"
 
-        with open(output_filename, 'w', encoding='utf-8') as dest_file:
-            dest_file.write(content)
+        result = transcode_file(filename, output_filename, source_encoding, target_encoding)
         
         print(f"\nSUCCESS: File copied successfully!")
         print(f"Original: {filename}")
@@ -47,11 +1202,18 @@ def copy_file_simple():
         print(f"\nOriginal file size: {original_size} bytes")
         print(f"Copy file size: {copy_size} bytes")
 
+        converted = codecs.lookup(source_encoding).name != codecs.lookup(target_encoding).name
         if original_size == copy_size:
             print("Verification: File sizes match.")
+        elif converted or result['converted_newlines']:
+            print("File sizes differ because the encoding or line endings (CRLF -> LF) were converted.")
         else:
             print("Warning: File sizes do not match!")
             
+    except LookupError as e:
+        print(f"\nERROR: {e}")
+    except UnicodeEncodeError as e:
+        print(f"\nERROR: The text cannot be written in the chosen encoding: {e}")
     except UnicodeDecodeError:
         print(f"\nERROR: Cannot read '{filename}' as a text file.")
         print("It might be a binary file. Try a different file.")
@@ -70,33 +1232,33 @@ def copy_file_with_verification():
         return
     
     try:
-        def get_file_hash(filepath):
-            hash_md5 = hashlib.md5()
-            with open(filepath, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b""):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
-        
-        original_hash = get_file_hash(filename)
-        print(f"Original file hash (MD5): {original_hash}")
+        choice = input(f"Hash algorithms ({', '.join(HASH_ALGORITHMS)}; Enter for md5, 'none' for a zero-copy copy): ")
+        algorithms = () if choice.strip().lower() == 'none' else parse_algorithms(choice)
+        verify = bool(algorithms) and input("Read the copy back to verify it? (y/n): ").strip().lower() == 'y'
 
         output_filename = f"{filename}_copy.txt"
 
-        with open(filename, 'rb') as source_file:
-            with open(output_filename, 'wb') as dest_file:
-                chunk_size = 8192
-                while True:
-                    chunk = source_file.read(chunk_size)
-                    if not chunk:
-                        break
-                    dest_file.write(chunk)
+        method, original_hashes = copy_file_data(filename, output_filename, algorithms)
         
         print(f"\nFile copied: {output_filename}")
-        copy_hash = get_file_hash(output_filename)
-        print(f"Copy file hash (MD5): {copy_hash}")
+        print(f"Copy method: {method}")
+        for name, digest in original_hashes.items():
+            print(f"Original file hash ({name.upper()}): {digest}")
+
+        if not verify:
+            if os.path.getsize(filename) == os.path.getsize(output_filename):
+                print("\n✓ SUCCESS: Copy written (sizes match, contents not read back)")
+            else:
+                print("\n✗ ERROR: Copy size does not match original!")
+            return
+
+        copy_hashes = hash_file(output_filename, algorithms, drop_cache=True)
+        for name, digest in copy_hashes.items():
+            print(f"Copy file hash ({name.upper()}): {digest}")
         
-        if original_hash == copy_hash:
-            print("\n✓ SUCCESS: Copy is identical to original (verified by MD5 hash)")
+        if original_hashes == copy_hashes:
+            names = ", ".join(name.upper() for name in algorithms)
+            print(f"\n✓ SUCCESS: Copy is identical to original (verified by {names} hash)")
         else:
             print("\n✗ ERROR: Copy does not match original!")
             
@@ -118,44 +1280,24 @@ def copy_multiple_files():
         print("No filenames provided.")
         return
     
+    workers = input(f"Number of copy threads (Enter for {COPY_WORKERS}): ").strip()
+    try:
+        workers = int(workers) if workers else COPY_WORKERS
+    except ValueError:
+        print("Invalid input. Please enter a whole number.")
+        return
+    
     successful_copies = []
     failed_copies = []
     
-    for filename in filenames:
-        if not os.path.exists(filename):
-            print(f"\n✗ '{filename}': File not found")
+    # Files are copied as raw bytes, so text and binary files are handled alike
+    for filename, output_filename, error in copy_files_parallel(filenames, max(1, workers)):
+        if error:
+            print(f"✗ '{filename}': {error}")
             failed_copies.append(filename)
-            continue
-        
-        try:
-            output_filename = f"{filename}_copy.txt"
-            
-            with open(filename, 'r', encoding='utf-8') as source_file:
-                content = source_file.read()
-            
-            with open(output_filename, 'w', encoding='utf-8') as dest_file:
-                dest_file.write(content)
-            
+        else:
             print(f"✓ '{filename}': Successfully copied to '{output_filename}'")
             successful_copies.append((filename, output_filename))
-            
-        except UnicodeDecodeError:
-            try:
-                output_filename = f"{filename}_copy.txt"
-                
-                with open(filename, 'rb') as source_file:
-                    with open(output_filename, 'wb') as dest_file:
-                        dest_file.write(source_file.read())
-                
-                print(f"✓ '{filename}': Successfully copied as binary")
-                successful_copies.append((filename, output_filename))
-                
-            except Exception as e:
-                print(f"✗ '{filename}': Error - {e}")
-                failed_copies.append(filename)
-        except Exception as e:
-            print(f"✗ '{filename}': Error - {e}")
-            failed_copies.append(filename)
 
     print("\n" + "=" * 60)
     print("COPY SUMMARY")
@@ -217,22 +1359,364 @@ def copy_specific_files():
         try:
             output_filename = f"{filename}_copy.txt"
             
-            with open(filename, 'r', encoding='utf-8') as source_file:
-                content = source_file.read()
-            
-            with open(output_filename, 'w', encoding='utf-8') as dest_file:
-                dest_file.write(content)
-            
-            lines = content.split('\n')
-            words = content.split()
+            result = transcode_file(filename, output_filename)
             
             print(f"\n✓ '{filename}': Successfully copied")
             print(f"   Output: {output_filename}")
-            print(f"   Stats: {len(lines)} lines, {len(words)} words, {len(content)} characters")
+            print(f"   Stats: {result['lines']} lines, {result['words']} words, {result['chars']} characters")
             
         except Exception as e:
             print(f"\n✗ '{filename}': Error - {e}")
 
+def copy_large_file_resumable():
+    print("=" * 60)
+    print("FILE COPIER - Resumable Copy of a Large File")
+    print("=" * 60)
+    
+    filename = input("Enter the filename to copy: ").strip()
+    
+    if not os.path.exists(filename):
+        print(f"\nERROR: File '{filename}' does not exist.")
+        return
+    
+    output_filename = f"{filename}_copy.txt"
+    if os.path.exists(manifest_path(output_filename)):
+        print("Found an unfinished copy - checking the chunks already copied...")
+
+    def show_progress(done, total):
+        print(f"  Chunk {done}/{total} copied")
+
+    try:
+        digest, resumed, copied = copy_file_resumable(filename, output_filename, progress=show_progress)
+        
+        print(f"\n✓ SUCCESS: File copied: {output_filename}")
+        if resumed:
+            print(f"Resumed after {resumed} chunks that were already copied, copied {copied} more")
+        print(f"Chunked digest (SHA256 of {RESUME_CHUNK_SIZE // (1024 * 1024)} MB chunk digests): {digest}")
+        
+    except KeyboardInterrupt:
+        print("\nCopy interrupted. Run it again to continue where it stopped.")
+    except Exception as e:
+        print(f"\nERROR: {e}")
+        print("Run it again to continue where it stopped.")
+
+def copy_file_update():
+    print("=" * 60)
+    print("FILE COPIER - Update an Existing Copy (Delta Copy)")
+    print("=" * 60)
+    
+    filename = input("Enter the filename to copy: ").strip()
+    
+    if not os.path.exists(filename):
+        print(f"\nERROR: File '{filename}' does not exist.")
+        return
+    
+    output_filename = f"{filename}_copy.txt"
+    if not os.path.exists(output_filename):
+        print(f"'{output_filename}' does not exist yet - making a full copy.")
+
+    try:
+        result = copy_file_delta(filename, output_filename)
+        
+        print(f"\n✓ SUCCESS: '{output_filename}' is up to date")
+        print(f"File size: {result['size']} bytes")
+        print(f"Bytes written: {result['written']} ({result['written'] / max(result['size'], 1):.1%} of the file)")
+        print(f"Unchanged blocks kept: {result['unchanged']} bytes")
+        if result['moved']:
+            print(f"Blocks found at a new offset (rewritten): {result['moved']} bytes")
+        
+    except Exception as e:
+        print(f"\nERROR: {e}")
+
+def copy_files_dedup():
+    print("=" * 60)
+    print("FILE COPIER - Deduplicating Copy")
+    print("=" * 60)
+    
+    file_input = input("Enter filenames to copy (separated by commas or spaces): ").strip()
+    filenames = [f for f in file_input.replace(',', ' ').split() if f]
+    
+    if not filenames:
+        print("No filenames provided.")
+        return
+    
+    link = input("Share identical content by 'reflink' or 'hardlink' (Enter for reflink): ").strip().lower() or 'reflink'
+    if link not in LINK_METHODS:
+        print("Invalid input. Please enter 'reflink' or 'hardlink'.")
+        return
+    
+    index = load_index()
+    total_bytes = 0
+    saved_bytes = 0
+    try:
+        for filename in filenames:
+            if not os.path.isfile(filename):
+                print(f"✗ '{filename}': File not found")
+                continue
+            output_filename = f"{filename}_copy.txt"
+            try:
+                method, saved = copy_file_dedup(filename, output_filename, index, link)
+                total_bytes += os.path.getsize(filename)
+                saved_bytes += saved
+                if saved:
+                    print(f"✓ '{filename}': Same content already stored - {method} to '{output_filename}'")
+                else:
+                    print(f"✓ '{filename}': Successfully copied to '{output_filename}'")
+            except Exception as e:
+                print(f"✗ '{filename}': Error - {e}")
+    finally:
+        save_index(index)
+    
+    print("\n" + "=" * 60)
+    print("DEDUPLICATION SUMMARY")
+    print("=" * 60)
+    print(f"Bytes copied: {total_bytes - saved_bytes}")
+    print(f"Bytes saved: {saved_bytes} ({saved_bytes / max(total_bytes, 1):.1%})")
+
+def copy_large_file_parallel():
+    print("=" * 60)
+    print("FILE COPIER - Parallel Copy of One Large File")
+    print("=" * 60)
+    
+    filename = input("Enter the filename to copy: ").strip()
+    
+    if not os.path.exists(filename):
+        print(f"\nERROR: File '{filename}' does not exist.")
+        return
+    
+    try:
+        workers = input(f"Number of copy threads (Enter for {SEGMENT_WORKERS}): ").strip()
+        workers = max(1, int(workers)) if workers else SEGMENT_WORKERS
+        segment_mb = input(f"Segment size in MB (Enter for {SEGMENT_SIZE // (1024 * 1024)}): ").strip()
+        segment_size = max(1, int(segment_mb)) * 1024 * 1024 if segment_mb else SEGMENT_SIZE
+        algorithm = input(f"Hash algorithm for a chunked digest ({', '.join(HASH_ALGORITHMS)}; Enter for none): ")
+        algorithm = parse_algorithms(algorithm, default=(None,))[0]
+    except ValueError as e:
+        print(f"Invalid input: {e}")
+        return
+    
+    output_filename = f"{filename}_copy.txt"
+    try:
+        started = time.time()
+        digest = copy_file_segmented(filename, output_filename, segment_size, workers, algorithm)
+        elapsed = max(time.time() - started, 1e-9)
+        
+        size = os.path.getsize(filename)
+        print(f"\n✓ SUCCESS: File copied: {output_filename}")
+        print(f"Copied {size} bytes in {elapsed:.2f} s ({size / elapsed / (1024 * 1024):.1f} MB/s) "
+              f"with {workers} threads")
+        if digest:
+            print(f"Chunked digest ({algorithm.upper()} of {segment_size // (1024 * 1024)} MB segment digests): {digest}")
+        
+    except Exception as e:
+        print(f"\nERROR: {e}")
+
+def verify_copy_tree_hash():
+    print("=" * 60)
+    print("FILE COPIER - Verify a Copy of a Large File")
+    print("=" * 60)
+    
+    filename = input("Enter the original filename: ").strip()
+    output_filename = f"{filename}_copy.txt"
+    
+    for path in (filename, output_filename):
+        if not os.path.exists(path):
+            print(f"\nERROR: File '{path}' does not exist.")
+            return
+    
+    mode = input("Digest type: 'tree' (parallel) or 'standard' (Enter for tree): ").strip().lower() or 'tree'
+    if mode not in ('tree', 'standard'):
+        print("Invalid input. Please enter 'tree' or 'standard'.")
+        return
+    try:
+        algorithm = parse_algorithms(input(f"Hash algorithm ({', '.join(HASH_ALGORITHMS)}; Enter for sha256): "),
+                                     default=('sha256',))[0]
+    except ValueError as e:
+        print(f"Invalid input: {e}")
+        return
+    
+    try:
+        started = time.time()
+        digests = []
+        for path in (filename, output_filename):
+            if mode == 'tree':
+                digests.append(tree_hash_file(path, algorithm))
+            else:
+                digests.append(hash_file(path, (algorithm,))[algorithm])
+        elapsed = max(time.time() - started, 1e-9)
+        
+        total = os.path.getsize(filename) + os.path.getsize(output_filename)
+        print(f"\nOriginal file hash ({algorithm.upper()}, {mode}): {digests[0]}")
+        print(f"Copy file hash ({algorithm.upper()}, {mode}): {digests[1]}")
+        print(f"Hashed {total} bytes in {elapsed:.2f} s ({total / elapsed / (1024 * 1024):.1f} MB/s)")
+        
+        if digests[0] == digests[1]:
+            print("\n✓ SUCCESS: Copy is identical to original")
+        else:
+            print("\n✗ ERROR: Copy does not match original!")
+        
+    except Exception as e:
+        print(f"\nERROR: {e}")
+
+def copy_directory_tree():
+    print("=" * 60)
+    print("FILE COPIER - Copy a Directory Tree")
+    print("=" * 60)
+    
+    source_dir = input("Enter the folder to copy: ").strip()
+    
+    if not os.path.isdir(source_dir):
+        print(f"\nERROR: Folder '{source_dir}' does not exist.")
+        return
+    
+    default_dest = f"{source_dir.rstrip(os.sep)}_copy"
+    dest_dir = input(f"Destination folder (Enter for '{default_dest}'): ").strip() or default_dest
+    
+    try:
+        started = time.time()
+        result = copy_tree(source_dir, dest_dir)
+        elapsed = max(time.time() - started, 1e-9)
+        
+        print("\n" + "=" * 60)
+        print("TREE COPY SUMMARY")
+        print("=" * 60)
+        print(f"Copied: {result['copied']} files ({result['bytes']} bytes)")
+        print(f"Unchanged (skipped): {result['skipped']} files")
+        print(f"Failed: {len(result['failed'])}")
+        for relative_path, error in result['failed'][:5]:
+            print(f"  ✗ {relative_path}: {error}")
+        if len(result['failed']) > 5:
+            print(f"  ... and {len(result['failed'])-5} more")
+        print(f"Time: {elapsed:.2f} s")
+        print(f"Manifest: {os.path.join(dest_dir, TREE_MANIFEST_NAME)}")
+        
+    except Exception as e:
+        print(f"\nERROR: {e}")
+
+def copy_multiple_files_durable():
+    print("=" * 60)
+    print("FILE COPIER - Durable Batch Copy")
+    print("=" * 60)
+    
+    file_input = input("Enter filenames to copy (separated by commas or spaces): ").strip()
+    filenames = [f for f in file_input.replace(',', ' ').split() if f]
+    
+    if not filenames:
+        print("No filenames provided.")
+        return
+    
+    mode = input("Flush to disk per 'group' or per 'file' (Enter for group): ").strip().lower() or 'group'
+    if mode not in ('group', 'file'):
+        print("Invalid input. Please enter 'group' or 'file'.")
+        return
+    
+    successful_copies = 0
+    failed_copies = 0
+    started = time.time()
+    for filename, output_filename, error in copy_files_durable(filenames, per_file=(mode == 'file')):
+        if error:
+            print(f"✗ '{filename}': {error}")
+            failed_copies += 1
+        else:
+            successful_copies += 1
+    elapsed = max(time.time() - started, 1e-9)
+    
+    print("\n" + "=" * 60)
+    print("DURABLE COPY SUMMARY")
+    print("=" * 60)
+    print(f"Total files: {len(filenames)}")
+    print(f"Successfully copied and flushed to disk: {successful_copies}")
+    print(f"Failed: {failed_copies}")
+    print(f"Time: {elapsed:.2f} s ({successful_copies / elapsed:.0f} files/s, flushed per {mode})")
+
+def copy_multiple_files_background():
+    print("=" * 60)
+    print("FILE COPIER - Background Copy with Rate Limits")
+    print("=" * 60)
+    
+    file_input = input("Enter filenames to copy (separated by commas or spaces): ").strip()
+    filenames = [f for f in file_input.replace(',', ' ').split() if f]
+    
+    if not filenames:
+        print("No filenames provided.")
+        return
+    
+    try:
+        mb_per_second = input("Bandwidth limit in MB/s (Enter for no limit): ").strip()
+        operations = input("I/O operations per second limit (Enter for no limit): ").strip()
+        limit = new_rate_limit(float(mb_per_second) * 1024 * 1024 if mb_per_second else None,
+                               float(operations) if operations else None)
+    except ValueError:
+        print("Invalid input. Please enter numbers.")
+        return
+    if not limit['bytes']['rate'] and not limit['operations']['rate']:
+        limit = None
+    drop_cache = input("Drop copied data from the page cache? (y/n): ").strip().lower() == 'y'
+    if input("Lower CPU and disk priority for the rest of this run? (y/n): ").strip().lower() == 'y':
+        print(f"Priority: {lower_priority()}")
+    
+    successful_copies = 0
+    copied_bytes = 0
+    started = time.time()
+    for filename, output_filename, error in copy_files_parallel(filenames, limit=limit, drop_cache=drop_cache):
+        if error:
+            print(f"✗ '{filename}': {error}")
+        else:
+            print(f"✓ '{filename}': Successfully copied to '{output_filename}'")
+            successful_copies += 1
+            copied_bytes += os.path.getsize(filename)
+    elapsed = max(time.time() - started, 1e-9)
+    
+    print("\n" + "=" * 60)
+    print("COPY SUMMARY")
+    print("=" * 60)
+    print(f"Successfully copied: {successful_copies} of {len(filenames)} files")
+    print(f"Throughput: {copied_bytes / elapsed / (1024 * 1024):.2f} MB/s over {elapsed:.2f} s")
+
+def audit_existing_copies():
+    print("=" * 60)
+    print("FILE COPIER - Check Existing Copies Against Their Originals")
+    print("=" * 60)
+    
+    directory = input("Folder to check (Enter for the current folder): ").strip() or '.'
+    
+    if not os.path.isdir(directory):
+        print(f"\nERROR: Folder '{directory}' does not exist.")
+        return
+    
+    try:
+        pairs, orphans = find_copy_pairs(directory)
+        if not pairs:
+            print(f"\nNo '*{COPY_SUFFIX}' files with their originals found in '{directory}'.")
+            return
+        
+        cache = load_index(AUDIT_CACHE_FILE)
+        started = time.time()
+        try:
+            summary, problems = audit_copies(pairs, cache)
+        finally:
+            save_index(cache, AUDIT_CACHE_FILE, MAX_AUDIT_ENTRIES)
+        elapsed = max(time.time() - started, 1e-9)
+        
+        for original, copy, problem in problems:
+            print(f"✗ '{copy}': {problem}")
+        
+        print("\n" + "=" * 60)
+        print("AUDIT SUMMARY")
+        print("=" * 60)
+        print(f"Copies checked: {len(pairs)}")
+        print(f"Matching: {summary['ok']}")
+        print(f"Mismatched: {summary['mismatched']}")
+        print(f"Could not be read: {summary['failed']}")
+        if orphans:
+            print(f"Copies without an original: {len(orphans)}")
+        print(f"Original digests reused from cache: {summary['cache_hits']}")
+        print(f"Hashed {summary['bytes_hashed']} bytes in {elapsed:.2f} s "
+              f"({summary['bytes_hashed'] / elapsed / 1e9:.2f} GB/s)")
+        
+    except Exception as e:
+        print(f"\nERROR: {e}")
+
 def main_menu():
     while True:
         print("\n" + "=" * 60)
@@ -242,10 +1726,19 @@ def main_menu():
         print("2. Enhanced copy with verification")
         print("3. Copy multiple files at once")
         print("4. Copy specific text files (spooky_story.txt, etc.)")
-        print("5. Exit")
+        print("5. Resumable copy of a large file")
+        print("6. Update an existing copy (only changed blocks)")
+        print("7. Copy with deduplication (link identical files)")
+        print("8. Parallel copy of one large file")
+        print("9. Verify an existing copy (parallel tree hash)")
+        print("10. Copy a whole directory tree")
+        print("11. Durable batch copy (safe against power loss)")
+        print("12. Background copy with bandwidth/IOPS limits")
+        print("13. Check existing copies in a folder (no copying)")
+        print("14. Exit")
         print("-" * 40)
         
-        choice = input("Enter your choice (1-5): ").strip()
+        choice = input("Enter your choice (1-14): ").strip()
         
         if choice == "1":
             copy_file_simple()
@@ -256,10 +1749,28 @@ def main_menu():
         elif choice == "4":
             copy_specific_files()
         elif choice == "5":
+            copy_large_file_resumable()
+        elif choice == "6":
+            copy_file_update()
+        elif choice == "7":
+            copy_files_dedup()
+        elif choice == "8":
+            copy_large_file_parallel()
+        elif choice == "9":
+            verify_copy_tree_hash()
+        elif choice == "10":
+            copy_directory_tree()
+        elif choice == "11":
+            copy_multiple_files_durable()
+        elif choice == "12":
+            copy_multiple_files_background()
+        elif choice == "13":
+            audit_existing_copies()
+        elif choice == "14":
             print("\nThank you for using File Copier. Goodbye!")
             break
         else:
-            print("\nInvalid choice. Please enter a number between 1 and 5.")
+            print("\nInvalid choice. Please enter a number between 1 and 14.")
         
         input("\nPress Enter to continue...")
 
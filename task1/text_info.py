@@ -6,7 +6,1426 @@
 # - Count how many lines, words, and characters are in the file.
 # - Print out the totals for each.
 
-def analyze_file():
+import bisect
+import bz2
+import codecs
+import glob
+import gzip
+import hashlib
+import heapq
+import io
+import json
+import lzma
+import math
+import mmap
+import os
+import random
+import re
+import time
+import zlib
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Files are read in fixed-size chunks so memory stays flat however big they are
+CHUNK_SIZE = 1024 * 1024
+SAMPLE_LINES = 3
+SAMPLE_WIDTH = 80
+# Only the first few invalid UTF-8 offsets are kept, the rest are just counted
+MAX_INVALID_OFFSETS = 10
+# Results of earlier runs, keyed by absolute path and checked against (inode, size, mtime_ns)
+CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'text_info_cache.json')
+MAX_CACHE_ENTRIES = 10000
+# Bytes before the old end of file that must be unchanged to count only the appended tail
+TAIL_CHECK_SIZE = 4096
+# Files smaller than two shards are not worth starting a process pool for
+MIN_SHARD_SIZE = 8 * 1024 * 1024
+# Word frequencies use a fixed number of Space-Saving counters and HyperLogLog registers
+TOP_WORDS_CAPACITY = 1000
+TOP_WORDS_SHOWN = 10
+HLL_PRECISION = 14
+# A "word" with no whitespace for megabytes is cut to this length
+MAX_WORD_LENGTH = 1000
+# Line lengths are kept in log buckets: exact below 16, then 8 buckets per power of two
+LINE_BUCKETS_EXACT = 16
+LINE_BUCKETS_PER_DOUBLING = 8
+LINE_PERCENTILES = (50, 95, 99)
+# Estimate mode reads random blocks of this size, up to the byte budget
+ESTIMATE_BLOCK_SIZE = 64 * 1024
+ESTIMATE_BUDGET = 16 * 1024 * 1024
+# z value for a 95% confidence interval
+CONFIDENCE_Z = 1.96
+
+def new_text_stats(with_words=False, with_lines=False):
+    """
+    Create the running totals used by the streaming analyzer.
+    Lines are counted as newlines + 1, the same as len(content.split('\n')).
+    with_words also keeps a word frequency sketch, with_lines a histogram
+    of line lengths.
+    """
+    stats = {
+        'newlines': 0,
+        'words': 0,
+        'chars': 0,
+        'chars_no_whitespace': 0,
+        'first_is_word': False,
+        'last_is_word': False,
+        'sample': [''],
+        'sample_open': True,
+    }
+    if with_words:
+        stats['word_sketch'] = new_word_sketch()
+    if with_lines:
+        stats['line_lengths'] = new_line_lengths()
+    return stats
+
+def new_word_sketch(capacity=TOP_WORDS_CAPACITY, registers=None):
+    """
+    Bounded-memory word frequencies. 'counts' holds at most capacity
+    Space-Saving counters (each an overestimate by at most 'errors'), and
+    'registers' is a HyperLogLog of every word seen. 'head' and 'pending'
+    are partial words at the start and end of the text, which may continue
+    in a neighbouring chunk or shard; 'head' is the whole text until the
+    first whitespace is seen.
+    """
+    return {
+        'capacity': capacity,
+        'counts': {},
+        'errors': {},
+        'dropped': False,
+        'registers': bytearray(1 << HLL_PRECISION) if registers is None else registers,
+        'head': '',
+        'pending': '',
+        'seen_space': False,
+    }
+
+def hash_word(word):
+    # hash() is randomised per process, so shards would not agree on it
+    digest = hashlib.blake2b(word.encode('utf-8', 'surrogatepass'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big')
+
+def add_to_hyperloglog(registers, words):
+    bits = 64 - HLL_PRECISION
+    low_mask = (1 << bits) - 1
+    for word in words:
+        value = hash_word(word)
+        index = value >> bits
+        rank = bits - (value & low_mask).bit_length() + 1
+        if rank > registers[index]:
+            registers[index] = rank
+
+def estimate_distinct(registers):
+    """
+    HyperLogLog estimate, with linear counting for small numbers of words.
+    """
+    size = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / size)
+    estimate = alpha * size * size / sum(2.0 ** -rank for rank in registers)
+    zeros = registers.count(0)
+    if estimate <= 2.5 * size and zeros:
+        estimate = size * math.log(size / zeros)
+    return round(estimate)
+
+def space_saving_floor(sketch):
+    """
+    The most times a word without a counter can have been seen.
+    """
+    return min(sketch['counts'].values()) if sketch['dropped'] else 0
+
+def merge_word_counts(first, second, extra_words=()):
+    """
+    Add two sets of Space-Saving counters (plus one for each of extra_words)
+    and keep the largest ones. A word missing from one side is charged that
+    side's floor, so counts stay overestimates and errors stay upper bounds
+    on the overcount.
+    """
+    first_floor = space_saving_floor(first)
+    second_floor = space_saving_floor(second)
+    if len(first['counts']) < len(second['counts']):
+        first, second = second, first
+        first_floor, second_floor = second_floor, first_floor
+
+    # Start from a copy of the bigger side and only walk the smaller one
+    counts = {word: count + second_floor for word, count in first['counts'].items()}
+    errors = {word: error + second_floor for word, error in first['errors'].items()}
+    for word, count in second['counts'].items():
+        if word in counts:
+            counts[word] += count - second_floor
+            errors[word] += second['errors'][word] - second_floor
+        else:
+            counts[word] = count + first_floor
+            errors[word] = second['errors'][word] + first_floor
+    for word in extra_words:
+        if word not in counts:
+            counts[word] = errors[word] = first_floor + second_floor
+        counts[word] += 1
+
+    dropped = first['dropped'] or second['dropped']
+    if len(counts) > first['capacity']:
+        kept = heapq.nlargest(first['capacity'], counts, key=counts.get)
+        counts = {word: counts[word] for word in kept}
+        errors = {word: errors[word] for word in kept}
+        dropped = True
+    return counts, errors, dropped
+
+def word_sketch_from_text(text, capacity=TOP_WORDS_CAPACITY, registers=None):
+    """
+    Sketch of one chunk of text. Passing the registers of the sketch the chunk
+    will be merged into saves merging a whole HyperLogLog for every chunk.
+    """
+    sketch = new_word_sketch(capacity, registers)
+    words = text.split()
+    if len(words) == 1 and len(words[0]) == len(text):
+        sketch['head'] = text[:MAX_WORD_LENGTH]
+        return sketch
+
+    sketch['seen_space'] = True
+    if words and not text[0].isspace():
+        sketch['head'] = words.pop(0)[:MAX_WORD_LENGTH]
+    if words and not text[-1].isspace():
+        sketch['pending'] = words.pop()[:MAX_WORD_LENGTH]
+
+    counts = Counter(words)
+    add_to_hyperloglog(sketch['registers'], counts)
+    if len(counts) > capacity:
+        counts = dict(counts.most_common(capacity))
+        sketch['dropped'] = True
+    sketch['counts'] = dict(counts)
+    sketch['errors'] = dict.fromkeys(counts, 0)
+    return sketch
+
+def merge_word_sketches(first, second):
+    """
+    Combine the sketches of two neighbouring pieces of text (first comes before
+    second), or of two different files. A word split across the edge is
+    joined back together and counted once.
+    """
+    finished_words = []
+    if not first['seen_space']:
+        head = (first['head'] + second['head'])[:MAX_WORD_LENGTH]
+        pending = second['pending']
+    elif not second['seen_space']:
+        head = first['head']
+        pending = (first['pending'] + second['head'])[:MAX_WORD_LENGTH]
+    else:
+        head = first['head']
+        pending = second['pending']
+        middle = (first['pending'] + second['head'])[:MAX_WORD_LENGTH]
+        if middle:
+            finished_words.append(middle)
+
+    if second['registers'] is first['registers']:
+        registers = first['registers']
+    else:
+        registers = bytearray(map(max, first['registers'], second['registers']))
+    add_to_hyperloglog(registers, finished_words)
+
+    merged = new_word_sketch(first['capacity'], registers)
+    merged['counts'], merged['errors'], merged['dropped'] = merge_word_counts(first, second, finished_words)
+    merged['head'] = head
+    merged['pending'] = pending
+    merged['seen_space'] = first['seen_space'] or second['seen_space']
+    return merged
+
+def update_word_sketch(sketch, text):
+    if text:
+        chunk = word_sketch_from_text(text, sketch['capacity'], sketch['registers'])
+        sketch.update(merge_word_sketches(sketch, chunk))
+
+def word_frequency_report(sketch, top=TOP_WORDS_SHOWN):
+    """
+    Count the partial words left at the ends of the text and return
+    ([(word, count, lowest possible count), ...], estimated distinct words).
+    """
+    edge_words = [word for word in (sketch['head'], sketch['pending']) if word]
+    registers = bytearray(sketch['registers'])
+    add_to_hyperloglog(registers, edge_words)
+    counts, errors, dropped = merge_word_counts(sketch, new_word_sketch(sketch['capacity'], registers), edge_words)
+
+    top_words = [(word, counts[word], counts[word] - errors[word])
+                 for word in heapq.nlargest(top, counts, key=counts.get)]
+    return top_words, estimate_distinct(registers)
+
+def finish_word_stats(stats):
+    if 'word_sketch' in stats:
+        stats['top_words'], stats['distinct_words'] = word_frequency_report(stats['word_sketch'])
+
+def new_line_lengths():
+    """
+    Histograms of line lengths in UTF-8 bytes and in words. Only lines that
+    are complete in this piece of the file are in the histograms; the text
+    before the first newline ('head') and after the last one ('tail') is
+    kept as [bytes, words] so it can be joined with the neighbouring pieces.
+    """
+    return {
+        'bytes': [],
+        'words': [],
+        'max_bytes': 0,
+        'max_words': 0,
+        'head': [0, 0],
+        'tail': [0, 0],
+        'has_newline': False,
+    }
+
+def length_bucket(length):
+    if length < LINE_BUCKETS_EXACT:
+        return length
+    shift = length.bit_length() - 4
+    return LINE_BUCKETS_EXACT + (shift - 1) * LINE_BUCKETS_PER_DOUBLING + (length >> shift) - 8
+
+def bucket_upper_bound(bucket):
+    if bucket < LINE_BUCKETS_EXACT:
+        return bucket
+    doublings, step = divmod(bucket - LINE_BUCKETS_EXACT, LINE_BUCKETS_PER_DOUBLING)
+    return ((step + 9) << (doublings + 1)) - 1
+
+def add_to_histogram(histogram, length_counts):
+    for length, count in length_counts.items():
+        bucket = length_bucket(length)
+        if bucket >= len(histogram):
+            histogram.extend([0] * (bucket + 1 - len(histogram)))
+        histogram[bucket] += count
+
+def add_line(line_lengths, line):
+    add_to_histogram(line_lengths['bytes'], {line[0]: 1})
+    add_to_histogram(line_lengths['words'], {line[1]: 1})
+    line_lengths['max_bytes'] = max(line_lengths['max_bytes'], line[0])
+    line_lengths['max_words'] = max(line_lengths['max_words'], line[1])
+
+def line_lengths_from_text(text):
+    """
+    Line lengths of one chunk of text. Returns (line lengths, word count);
+    no word crosses a newline, so the words per line add up to the chunk's.
+    """
+    lines = text.split('\n')
+    if text.isascii():
+        byte_lengths = list(map(len, lines))
+    else:
+        byte_lengths = list(map(len, text.encode('utf-8', 'surrogatepass').split(b'\n')))
+    word_counts = list(map(len, map(str.split, lines)))
+
+    line_lengths = new_line_lengths()
+    line_lengths['head'] = [byte_lengths[0], word_counts[0]]
+    line_lengths['tail'] = [byte_lengths[-1], word_counts[-1]]
+    if len(lines) > 1:
+        line_lengths['has_newline'] = True
+        add_to_histogram(line_lengths['bytes'], Counter(byte_lengths[1:-1]))
+        add_to_histogram(line_lengths['words'], Counter(word_counts[1:-1]))
+        line_lengths['max_bytes'] = max(byte_lengths[1:-1], default=0)
+        line_lengths['max_words'] = max(word_counts[1:-1], default=0)
+    return line_lengths, sum(word_counts)
+
+def merge_line_lengths(first, second, split_word=False, split_crlf=False):
+    """
+    Combine the line lengths of two neighbouring pieces (first comes before
+    second). The tail of first and the head of second are one line. With
+    split_word a word runs across the edge; with split_crlf the edge cuts a
+    \r\n that both pieces counted as a newline, so there is no line between.
+    """
+    merged = {}
+    for key in ('bytes', 'words'):
+        longer, shorter = sorted((first[key], second[key]), key=len, reverse=True)
+        merged[key] = list(longer)
+        for bucket, count in enumerate(shorter):
+            merged[key][bucket] += count
+    merged['max_bytes'] = max(first['max_bytes'], second['max_bytes'])
+    merged['max_words'] = max(first['max_words'], second['max_words'])
+
+    joined = [first['tail'][0] + second['head'][0], first['tail'][1] + second['head'][1] - split_word]
+    merged['head'] = first['head'] if first['has_newline'] else joined
+    merged['tail'] = second['tail'] if second['has_newline'] else joined
+    merged['has_newline'] = first['has_newline'] or second['has_newline']
+    if first['has_newline'] and second['has_newline'] and not split_crlf:
+        add_line(merged, joined)
+    return merged
+
+def line_length_report(line_lengths):
+    """
+    Percentiles and maximum of the line lengths, in bytes and in words.
+    A percentile is the top of its bucket (at most 12.5% above the true
+    value) but never more than the maximum. The first and last lines count too.
+    """
+    final = merge_line_lengths(line_lengths, new_line_lengths())
+    if final['has_newline']:
+        add_line(final, final['head'])
+    add_line(final, final['tail'])
+    report = {}
+    for key in ('bytes', 'words'):
+        histogram = final[key]
+        total = sum(histogram)
+        report[key] = {'max': final['max_' + key]}
+        for percentile in LINE_PERCENTILES:
+            rank = max(1, math.ceil(total * percentile / 100))
+            seen = 0
+            for bucket, count in enumerate(histogram):
+                seen += count
+                if seen >= rank:
+                    break
+            report[key][percentile] = min(bucket_upper_bound(bucket), final['max_' + key])
+    return report
+
+def update_sample(stats, text):
+    """
+    Keep the first few lines of the file, each cut to just over the display width.
+    """
+    sample = stats['sample']
+    pos = 0
+    while stats['sample_open']:
+        end = text.find('\n', pos)
+        room = SAMPLE_WIDTH + 1 - len(sample[-1])
+        if room > 0:
+            stop = len(text) if end == -1 else end
+            sample[-1] += text[pos:min(stop, pos + room)]
+        if end == -1:
+            break
+        if len(sample) == SAMPLE_LINES:
+            stats['sample_open'] = False
+        else:
+            sample.append('')
+        pos = end + 1
+
+def update_text_stats(stats, text):
+    """
+    Add one decoded chunk of text to the running totals.
+    A word split across two chunks is only counted once.
+    """
+    if not text:
+        return
+
+    if stats['chars'] == 0:
+        stats['first_is_word'] = not text[0].isspace()
+
+    split_word = stats['last_is_word'] and not text[0].isspace()
+    if 'line_lengths' in stats:
+        line_lengths, word_count = line_lengths_from_text(text)
+        stats['line_lengths'] = merge_line_lengths(stats['line_lengths'], line_lengths, split_word)
+    else:
+        word_count = len(text.split())
+    if split_word:
+        word_count -= 1
+
+    stats['newlines'] += text.count('\n')
+    stats['words'] += word_count
+
+    stats['chars'] += len(text)
+    stats['chars_no_whitespace'] += len(text) - text.count(' ') - text.count('\n') - text.count('\t')
+    stats['last_is_word'] = not text[-1].isspace()
+
+    if stats['sample_open']:
+        update_sample(stats, text)
+
+    if 'word_sketch' in stats:
+        update_word_sketch(stats['word_sketch'], text)
+
+def make_decoder(encoding='utf-8', errors='strict'):
+    """
+    Decoder that translates newlines the same way as open(filename, 'r') does.
+    """
+    return io.IncrementalNewlineDecoder(codecs.getincrementaldecoder(encoding)(errors), translate=True)
+
+def analyze_chunks(chunks, stats=None, encoding='utf-8'):
+    """
+    Decode an iterable of byte chunks and return their running totals.
+    """
+    if stats is None:
+        stats = new_text_stats()
+
+    decoder = make_decoder(encoding)
+    for chunk in chunks:
+        update_text_stats(stats, decoder.decode(chunk))
+    update_text_stats(stats, decoder.decode(b'', final=True))
+
+    stats['lines'] = stats['newlines'] + 1
+    return stats
+
+def analyze_stream(binary_file, stats=None, chunk_size=CHUNK_SIZE, encoding='utf-8'):
+    """
+    Read a binary file object chunk by chunk and return its running totals.
+    """
+    return analyze_chunks(iter(lambda: binary_file.read(chunk_size), b""), stats, encoding)
+
+def compute_text_stats(filename, chunk_size=CHUNK_SIZE, with_words=False, with_lines=False):
+    with open(filename, 'rb') as file:
+        if detect_compression(file.read(6)):
+            return compute_text_stats_compressed(filename, 1, chunk_size, with_words, with_lines)
+        file.seek(0)
+        stats = analyze_stream(file, new_text_stats(with_words, with_lines), chunk_size)
+    finish_word_stats(stats)
+    return stats
+
+def read_range(file, start, end, chunk_size=CHUNK_SIZE):
+    """
+    Yield the bytes between start and end in chunks, stopping early at end of file.
+    """
+    file.seek(start)
+    while start < end:
+        chunk = file.read(min(chunk_size, end - start))
+        if not chunk:
+            break
+        start += len(chunk)
+        yield chunk
+
+def load_cache(cache_file=CACHE_FILE):
+    try:
+        with open(cache_file, 'r', encoding='utf-8') as file:
+            return json.load(file)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+def save_cache(cache, cache_file=CACHE_FILE):
+    """
+    Write the cache, dropping the least recently used entries beyond MAX_CACHE_ENTRIES.
+    The file is replaced atomically so a crash never leaves half a cache behind.
+    """
+    if len(cache) > MAX_CACHE_ENTRIES:
+        oldest_first = sorted(cache, key=lambda path: cache[path]['used'])
+        for path in oldest_first[:len(cache) - MAX_CACHE_ENTRIES]:
+            del cache[path]
+
+    os.makedirs(os.path.dirname(cache_file) or '.', exist_ok=True)
+    temp_file = f"{cache_file}.{os.getpid()}.tmp"
+    with open(temp_file, 'w', encoding='utf-8') as file:
+        json.dump(cache, file)
+    os.replace(temp_file, cache_file)
+
+def clear_cache(filename=None, cache_file=CACHE_FILE):
+    """
+    Forget the stored result for one file, or the whole cache when no filename is given.
+    """
+    if filename is None:
+        if os.path.exists(cache_file):
+            os.remove(cache_file)
+        return
+    cache = load_cache(cache_file)
+    if cache.pop(os.path.abspath(filename), None) is not None:
+        save_cache(cache, cache_file)
+
+def tail_fingerprint(file, size):
+    """
+    MD5 of the last TAIL_CHECK_SIZE bytes before size, and whether they end with a carriage return.
+    """
+    start = max(0, size - TAIL_CHECK_SIZE)
+    file.seek(start)
+    data = file.read(size - start)
+    return hashlib.md5(data).hexdigest(), data.endswith(b'\r')
+
+def compute_text_stats_cached(filename, cache):
+    """
+    Return stored totals when the file is unchanged. When it has only grown
+    by appending, count just the new bytes and add them to the stored totals.
+    stats['cache_status'] says which of 'hit', 'appended' or 'miss' happened.
+    """
+    path = os.path.abspath(filename)
+    info = os.stat(path)
+    entry = cache.get(path)
+    same_inode = entry is not None and entry['inode'] == info.st_ino
+
+    if same_inode and entry['size'] == info.st_size and entry['mtime_ns'] == info.st_mtime_ns:
+        entry['used'] = time.time()
+        return dict(entry['stats'], cache_status='hit', appended_bytes=0)
+
+    appended_bytes = 0
+    with open(path, 'rb') as file:
+        compression = detect_compression(file.read(6))
+        if compression:
+            stats = compute_text_stats_compressed(path)
+            status = 'miss'
+        elif (same_inode and info.st_size > entry['size'] and not entry.get('compression')
+                and tail_fingerprint(file, entry['size'])[0] == entry['tail_hash']):
+            old = entry['stats']
+            start = entry['size']
+            # The \n of a \r\n split by the old end of file was already counted
+            if old['ends_with_cr'] and file.read(1) == b'\n':
+                start += 1
+            tail = new_text_stats()
+            tail['sample'] = list(old['sample'])
+            tail['sample_open'] = old['sample_open']
+            analyze_chunks(read_range(file, start, info.st_size), tail)
+            stats = merge_text_stats(old, tail)
+            stats['sample'] = tail['sample']
+            stats['sample_open'] = tail['sample_open']
+            status = 'appended'
+            appended_bytes = info.st_size - entry['size']
+        else:
+            stats = analyze_chunks(read_range(file, 0, info.st_size))
+            status = 'miss'
+
+        tail_hash, stats['ends_with_cr'] = tail_fingerprint(file, info.st_size)
+
+    cache[path] = {
+        'compression': compression,
+        'inode': info.st_ino,
+        'size': info.st_size,
+        'mtime_ns': info.st_mtime_ns,
+        'tail_hash': tail_hash,
+        'used': time.time(),
+        'stats': stats,
+    }
+    return dict(stats, cache_status=status, appended_bytes=appended_bytes)
+
+def read_sample(filename, chunk_size=64 * 1024, encoding='utf-8'):
+    """
+    Read just enough of the start of the file to fill the sample lines.
+    """
+    stats = new_text_stats()
+    decoder = make_decoder(encoding, errors='replace')
+    file, compression = open_text_source(filename)
+    with file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            update_sample(stats, decoder.decode(chunk))
+            if not stats['sample_open']:
+                break
+        else:
+            update_sample(stats, decoder.decode(b'', final=True))
+    return stats['sample']
+
+def merge_text_stats(first, second):
+    """
+    Combine the totals of two neighbouring pieces of a file (first comes before second).
+    Fixes up a word or a CRLF pair that was split across the edge.
+    """
+    if first['chars'] == 0:
+        return dict(second)
+    if second['chars'] == 0:
+        return dict(first)
+
+    merged = dict(first)
+    for key in ('newlines', 'words', 'chars', 'chars_no_whitespace'):
+        merged[key] = first[key] + second[key]
+
+    if first['last_is_word'] and second['first_is_word']:
+        merged['words'] -= 1
+
+    # Both halves turned their side of a split \r\n into a newline
+    split_crlf = first.get('ends_with_cr', False) and second.get('starts_with_lf', False)
+    if split_crlf:
+        merged['newlines'] -= 1
+        merged['chars'] -= 1
+
+    if 'line_lengths' in first and 'line_lengths' in second:
+        merged['line_lengths'] = merge_line_lengths(first['line_lengths'], second['line_lengths'],
+                                                    first['last_is_word'] and second['first_is_word'], split_crlf)
+    else:
+        merged.pop('line_lengths', None)
+
+    if 'word_sketch' in first and 'word_sketch' in second:
+        merged['word_sketch'] = merge_word_sketches(first['word_sketch'], second['word_sketch'])
+
+    merged['last_is_word'] = second['last_is_word']
+    merged['ends_with_cr'] = second.get('ends_with_cr', False)
+    merged['lines'] = merged['newlines'] + 1
+    return merged
+
+def split_into_shards(mapped, shard_count):
+    """
+    Split a mapped file into byte ranges, moving each edge forward
+    so it never lands in the middle of a UTF-8 character.
+    """
+    size = len(mapped)
+    edges = [0]
+    for i in range(1, shard_count):
+        pos = max(size * i // shard_count, edges[-1])
+        while pos < size and mapped[pos] & 0xC0 == 0x80:
+            pos += 1
+        edges.append(pos)
+    edges.append(size)
+    return [(start, end) for start, end in zip(edges, edges[1:]) if end > start]
+
+def count_shard(args):
+    """
+    Worker for the process pool: count one byte range of the file.
+    """
+    filename, start, end, chunk_size, with_words, with_lines = args
+    stats = new_text_stats(with_words, with_lines)
+    stats['sample_open'] = False
+
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            chunks = (mapped[pos:min(pos + chunk_size, end)] for pos in range(start, end, chunk_size))
+            analyze_chunks(chunks, stats)
+            stats['starts_with_lf'] = mapped[start] == 0x0A
+            stats['ends_with_cr'] = mapped[end - 1] == 0x0D
+    return stats
+
+def compute_text_stats_parallel(filename, workers=None, chunk_size=CHUNK_SIZE, with_words=False, with_lines=False):
+    """
+    Count a large file in several processes and merge the results.
+    Gives exactly the same totals as compute_text_stats.
+    """
+    workers = workers or os.cpu_count() or 1
+    with open(filename, 'rb') as file:
+        if detect_compression(file.read(6)):
+            return compute_text_stats_compressed(filename, workers, chunk_size, with_words, with_lines)
+    file_size = os.path.getsize(filename)
+    shard_count = min(workers * 4, file_size // MIN_SHARD_SIZE)
+
+    if workers == 1 or shard_count < 2:
+        return compute_text_stats(filename, chunk_size, with_words, with_lines)
+
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            shards = split_into_shards(mapped, shard_count)
+
+    jobs = [(filename, start, end, chunk_size, with_words, with_lines) for start, end in shards]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        partials = list(executor.map(count_shard, jobs))
+
+    stats = new_text_stats()
+    for partial in partials:
+        stats = merge_text_stats(stats, partial)
+    stats['lines'] = stats['newlines'] + 1
+    stats['sample'] = read_sample(filename)
+    finish_word_stats(stats)
+    return stats
+
+# Magic bytes at the start of compressed files
+COMPRESSION_MAGIC = [
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bzip2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+]
+
+def detect_compression(head):
+    for magic, compression in COMPRESSION_MAGIC:
+        if head.startswith(magic):
+            return compression
+    return None
+
+def open_text_source(filename):
+    """
+    Open a file for binary reading, decompressing it on the fly when it is
+    gzip, bzip2 or xz compressed. Returns (file, compression or None).
+    """
+    with open(filename, 'rb') as file:
+        compression = detect_compression(file.read(6))
+    if compression == 'gzip':
+        return gzip.open(filename, 'rb'), compression
+    if compression == 'bzip2':
+        return bz2.open(filename, 'rb'), compression
+    if compression == 'xz':
+        return lzma.open(filename, 'rb'), compression
+    return open(filename, 'rb'), None
+
+def is_gzip_header(mapped, pos):
+    """
+    Cheap check that a gzip member could start at pos: magic, deflate method,
+    no reserved flag bits set.
+    """
+    header = mapped[pos:pos + 4]
+    return len(header) == 4 and header[:3] == b'\x1f\x8b\x08' and header[3] & 0xE0 == 0
+
+def find_gzip_member_candidates(mapped):
+    """
+    Offsets where a gzip member header appears. Some may be false positives
+    inside compressed data; those are weeded out when members are chained.
+    """
+    candidates = []
+    pos = mapped.find(b'\x1f\x8b\x08')
+    while pos != -1:
+        if is_gzip_header(mapped, pos):
+            candidates.append(pos)
+        pos = mapped.find(b'\x1f\x8b\x08', pos + 1)
+    return candidates
+
+def count_gzip_members(args):
+    """
+    Worker for the process pool: decompress and count the gzip members that
+    start at 'start', going on until a member ends at or after 'stop'.
+    Members are not aligned to characters, so any continuation bytes at the
+    start ('lead') and an unfinished character at the end ('tail') are
+    returned raw for the caller to count with their neighbours.
+    """
+    filename, start, stop, chunk_size, with_lines = args
+    stats = new_text_stats(with_lines=with_lines)
+    stats['sample_open'] = False
+    decoder = make_decoder()
+    lead = b""
+    in_lead = True
+    carried = b""
+    uncompressed = 0
+    pos = start
+
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            while True:
+                member = zlib.decompressobj(wbits=31)
+                while not member.eof:
+                    if member.unconsumed_tail:
+                        data = member.unconsumed_tail
+                    else:
+                        data = mapped[pos:pos + chunk_size]
+                        pos += len(data)
+                    output = member.decompress(data, chunk_size)
+                    if not output:
+                        if not data and not member.eof:
+                            raise EOFError("Compressed file ended before the end-of-stream marker was reached")
+                        continue
+                    uncompressed += len(output)
+
+                    if in_lead:
+                        skip = 0
+                        while skip < len(output) and len(lead) + skip < 3 and output[skip] & 0xC0 == 0x80:
+                            skip += 1
+                        lead, output = lead + output[:skip], output[skip:]
+                        if output:
+                            in_lead = False
+                            stats['starts_with_lf'] = output[:1] == b'\n'
+
+                    output = carried + output
+                    cut = len(output) - split_incomplete_tail(output)
+                    update_text_stats(stats, decoder.decode(output[:cut]))
+                    carried = output[cut:]
+                    if output:
+                        stats['ends_with_cr'] = output.endswith(b'\r')
+
+                pos -= len(member.unused_data)
+                more_members = is_gzip_header(mapped, pos)
+                if pos >= stop or not more_members:
+                    break
+
+    update_text_stats(stats, decoder.decode(b'', final=True))
+    stats['lines'] = stats['newlines'] + 1
+    return {'start': start, 'end': pos, 'more_members': more_members, 'stats': stats,
+            'lead': lead, 'only_lead': in_lead, 'tail': carried, 'uncompressed': uncompressed}
+
+def count_gzip_parallel(filename, workers, chunk_size=CHUNK_SIZE, with_lines=False):
+    """
+    Decompress a multi-member gzip file (as written by pigz, bgzip or
+    'cat a.gz b.gz') in several processes. Returns (stats, uncompressed bytes),
+    or None when the file has only one member and cannot be split.
+    """
+    with open(filename, 'rb') as file:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            size = len(mapped)
+            candidates = find_gzip_member_candidates(mapped)
+
+    # Start each job at the first member header after an even split point
+    starts = []
+    for i in range(workers * 4):
+        index = bisect.bisect_left(candidates, size * i // (workers * 4))
+        if index < len(candidates) and (not starts or candidates[index] > starts[-1]):
+            starts.append(candidates[index])
+    if len(starts) < 2 or starts[0] != 0:
+        return None
+
+    stops = starts[1:] + [size]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = {executor.submit(count_gzip_members, (filename, start, stop, chunk_size, with_lines)): start
+                for start, stop in zip(starts, stops)}
+        results = {}
+        for job in as_completed(jobs):
+            # A job started on a false header fails or is never reached by the chain
+            if job.exception() is None:
+                results[jobs[job]] = job.result()
+
+    stats = new_text_stats()
+    uncompressed = 0
+    tail = b""
+    pos = 0
+    while True:
+        result = results.get(pos)
+        if result is None:
+            # The previous job's members ran past a false split point; carry on from here
+            index = bisect.bisect_right(starts, pos)
+            stop = starts[index] if index < len(starts) else size
+            result = count_gzip_members((filename, pos, stop, chunk_size, with_lines))
+        piece = tail + result['lead']
+        if result['only_lead']:
+            # Members too short to finish the character, keep joining
+            tail = piece
+        else:
+            if piece:
+                stats = merge_text_stats(stats, analyze_chunks([piece], new_text_stats(with_lines=with_lines)))
+            stats = merge_text_stats(stats, result['stats'])
+            tail = result['tail']
+        uncompressed += result['uncompressed']
+        pos = result['end']
+        if not result['more_members']:
+            break
+
+    if tail:
+        # Raises UnicodeDecodeError if the data ends in the middle of a character
+        stats = merge_text_stats(stats, analyze_chunks([tail], new_text_stats(with_lines=with_lines)))
+    stats['lines'] = stats['newlines'] + 1
+    return stats, uncompressed
+
+def compute_text_stats_compressed(filename, workers=1, chunk_size=CHUNK_SIZE, with_words=False, with_lines=False):
+    """
+    Count a gzip, bzip2 or xz file while decompressing it, without a temporary
+    file. Multi-member gzip files are decompressed in parallel when workers > 1.
+    """
+    stats = None
+    source, compression = open_text_source(filename)
+    with source:
+        if (compression == 'gzip' and workers > 1 and not with_words
+                and os.path.getsize(filename) >= 2 * MIN_SHARD_SIZE):
+            counted = count_gzip_parallel(filename, workers, chunk_size, with_lines)
+            if counted is not None:
+                stats, uncompressed = counted
+
+        if stats is None:
+            uncompressed = 0
+            def chunks():
+                nonlocal uncompressed
+                for chunk in iter(lambda: source.read(chunk_size), b""):
+                    uncompressed += len(chunk)
+                    yield chunk
+            stats = analyze_chunks(chunks(), new_text_stats(with_words, with_lines))
+
+    finish_word_stats(stats)
+    stats['sample'] = read_sample(filename)
+    stats['compression'] = compression
+    stats['compressed_bytes'] = os.path.getsize(filename)
+    stats['uncompressed_bytes'] = uncompressed
+    return stats
+
+def expand_corpus(patterns):
+    """
+    Turn globs and directory names into a list of files.
+    Directories are walked recursively and each file is listed once.
+    """
+    filenames = []
+    seen = set()
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = [os.path.join(root, name) for root, dirs, files in os.walk(pattern) for name in files]
+        else:
+            matches = glob.glob(pattern, recursive=True)
+        for name in sorted(os.path.normpath(match) for match in matches):
+            if name not in seen and os.path.isfile(name):
+                seen.add(name)
+                filenames.append(name)
+    return filenames
+
+def analyze_corpus_files(filenames, workers=None, chunk_size=CHUNK_SIZE):
+    """
+    Count many files in a process pool and yield (filename, stats, error)
+    as each one finishes. Files of two shards or more are split so a single
+    big file is spread over several workers instead of holding one.
+    """
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        jobs = {}
+        parts = {}
+        remaining = {}
+
+        for filename in filenames:
+            try:
+                size = os.path.getsize(filename)
+                if size == 0:
+                    yield filename, analyze_chunks([]), None
+                    continue
+                with open(filename, 'rb') as file:
+                    compression = detect_compression(file.read(6))
+                if compression:
+                    # Compressed files cannot be split by byte range, count them whole
+                    job = executor.submit(compute_text_stats_compressed, filename, 1, chunk_size)
+                    parts[filename] = [None]
+                    remaining[filename] = 1
+                    jobs[job] = (filename, 0)
+                    continue
+                if size >= 2 * MIN_SHARD_SIZE:
+                    with open(filename, 'rb') as file:
+                        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                            shards = split_into_shards(mapped, size // MIN_SHARD_SIZE)
+                else:
+                    shards = [(0, size)]
+            except OSError as e:
+                yield filename, None, e
+                continue
+
+            parts[filename] = [None] * len(shards)
+            remaining[filename] = len(shards)
+            for index, (start, end) in enumerate(shards):
+                job = executor.submit(count_shard, (filename, start, end, chunk_size, False, False))
+                jobs[job] = (filename, index)
+
+        for job in as_completed(jobs):
+            filename, index = jobs[job]
+            if filename not in parts:
+                # Another shard of this file already failed
+                continue
+            if job.exception() is not None:
+                del parts[filename]
+                yield filename, None, job.exception()
+                continue
+
+            parts[filename][index] = job.result()
+            remaining[filename] -= 1
+            if remaining[filename] == 0:
+                stats = new_text_stats()
+                for partial in parts.pop(filename):
+                    stats = merge_text_stats(stats, partial)
+                stats['lines'] = stats['newlines'] + 1
+                yield filename, stats, None
+
+def utf8_sequence_length(lead_byte):
+    if lead_byte >= 0xF0:
+        return 4
+    if lead_byte >= 0xE0:
+        return 3
+    if lead_byte >= 0xC0:
+        return 2
+    return 1
+
+def split_incomplete_tail(data):
+    """
+    Return how many bytes at the end of data belong to a UTF-8 character
+    that continues in the next chunk.
+    """
+    for back in range(1, min(4, len(data)) + 1):
+        byte = data[-back]
+        if byte & 0xC0 != 0x80:
+            return back if utf8_sequence_length(byte) > back else 0
+    return 0
+
+# Bytes that str.split() treats as whitespace: \t \n \v \f \r, \x1c-\x1f and space
+ASCII_WHITESPACE = b'\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f '
+# UTF-8 encodings of the non-ASCII characters str.split() treats as whitespace (U+3000 is the last)
+UNICODE_WHITESPACE = [chr(c).encode('utf-8') for c in range(0x80, 0x3001) if chr(c).isspace()]
+
+if np is not None:
+    NUMPY_WHITESPACE_TABLE = np.zeros(256, dtype=bool)
+    NUMPY_WHITESPACE_TABLE[list(ASCII_WHITESPACE)] = True
+    # Multi-byte whitespace is looked up as (lead << 8 | next) or (lead << 16 | next << 8 | last)
+    NUMPY_WHITESPACE_LEAD_TABLE = np.zeros(256, dtype=bool)
+    NUMPY_WHITESPACE_LEAD_TABLE[[seq[0] for seq in UNICODE_WHITESPACE]] = True
+    NUMPY_WHITESPACE_KEYS = np.array([int.from_bytes(seq, 'big') for seq in UNICODE_WHITESPACE], dtype=np.uint32)
+
+def count_bytes_numpy(stats, data):
+    """
+    Add one chunk of whole UTF-8 characters to the running totals using NumPy.
+    Characters are counted by skipping continuation bytes and words by
+    counting whitespace to non-whitespace transitions, so nothing is decoded.
+    Words are found byte by byte, so like count_bytes_python a stray
+    continuation byte counts as part of a word.
+    """
+    if len(data) == 0:
+        return
+
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    whitespace = NUMPY_WHITESPACE_TABLE[buffer]
+
+    is_ascii = buffer.max() < 0x80
+    if not is_ascii:
+        starts = np.flatnonzero(NUMPY_WHITESPACE_LEAD_TABLE[buffer])
+        last = len(buffer) - 1
+        two_bytes = (buffer[starts].astype(np.uint32) << 8) | buffer[np.minimum(starts + 1, last)]
+        three_bytes = (two_bytes << 8) | buffer[np.minimum(starts + 2, last)]
+        # Reads past the end were clamped to the last byte, so drop those matches
+        found_two = starts[np.isin(two_bytes, NUMPY_WHITESPACE_KEYS) & (starts + 1 <= last)]
+        found_three = starts[np.isin(three_bytes, NUMPY_WHITESPACE_KEYS) & (starts + 2 <= last)]
+        # Mark every byte of a whitespace character, not just its lead byte
+        for found, length in ((found_two, 2), (found_three, 3)):
+            for position in range(length):
+                whitespace[found + position] = True
+
+    char_count = len(buffer) if is_ascii else int(np.count_nonzero((buffer & 0xC0) != 0x80))
+
+    previous_is_space = np.empty(len(buffer), dtype=bool)
+    previous_is_space[0] = not stats['last_is_word']
+    previous_is_space[1:] = whitespace[:-1]
+    word_starts = int(np.count_nonzero(previous_is_space & ~whitespace))
+
+    line_feeds = int(np.count_nonzero(buffer == 0x0A))
+    carriage_returns = int(np.count_nonzero(buffer == 0x0D))
+    crlf_pairs = int(np.count_nonzero((buffer[:-1] == 0x0D) & (buffer[1:] == 0x0A)))
+    if stats.get('ends_with_cr') and buffer[0] == 0x0A:
+        crlf_pairs += 1
+    newlines = line_feeds + carriage_returns - crlf_pairs
+    spaces_and_tabs = int(np.count_nonzero((buffer == 0x20) | (buffer == 0x09)))
+
+    # A chunk of only stray continuation bytes adds a word but no characters
+    if stats['chars'] == 0 and stats['words'] == 0:
+        stats['first_is_word'] = not whitespace[0]
+    stats['newlines'] += newlines
+    stats['words'] += word_starts
+    stats['chars'] += char_count - crlf_pairs
+    stats['chars_no_whitespace'] += char_count - crlf_pairs - newlines - spaces_and_tabs
+    stats['last_is_word'] = not whitespace[-1]
+    stats['ends_with_cr'] = buffer[-1] == 0x0D
+
+# Everything except UTF-8 continuation bytes (0x80-0xBF), deleted to count them
+NOT_CONTINUATION_BYTES = bytes(b for b in range(256) if b & 0xC0 != 0x80)
+# bytes.split() does not split on \x1c-\x1f but str.split() does
+SEPARATORS_TO_SPACE = bytes.maketrans(b'\x1c\x1d\x1e\x1f', b'    ')
+
+def count_bytes_python(stats, data):
+    """
+    Pure Python version of count_bytes_numpy, built on C-speed bytes methods.
+    """
+    data = bytes(data)
+    if not data:
+        return
+
+    char_count = len(data) - len(data.translate(None, NOT_CONTINUATION_BYTES))
+
+    spaced = data.translate(SEPARATORS_TO_SPACE)
+    if not data.isascii():
+        for sequence in UNICODE_WHITESPACE:
+            if sequence[0] in spaced and sequence in spaced:
+                spaced = spaced.replace(sequence, b' ')
+    word_count = len(spaced.split())
+    first_is_word = spaced[0] not in ASCII_WHITESPACE
+    if stats['last_is_word'] and first_is_word:
+        word_count -= 1
+
+    crlf_pairs = data.count(b'\r\n')
+    if stats.get('ends_with_cr') and data[0] == 0x0A:
+        crlf_pairs += 1
+    newlines = data.count(b'\n') + data.count(b'\r') - crlf_pairs
+    spaces_and_tabs = data.count(b' ') + data.count(b'\t')
+
+    if stats['chars'] == 0 and stats['words'] == 0:
+        stats['first_is_word'] = first_is_word
+    stats['newlines'] += newlines
+    stats['words'] += word_count
+    stats['chars'] += char_count - crlf_pairs
+    stats['chars_no_whitespace'] += char_count - crlf_pairs - newlines - spaces_and_tabs
+    stats['last_is_word'] = spaced[-1] not in ASCII_WHITESPACE
+    stats['ends_with_cr'] = data[-1] == 0x0D
+
+# Runs of well-formed UTF-8 (RFC 3629: no overlongs, surrogates or values above U+10FFFF)
+UTF8_VALID_RUN = re.compile(
+    rb'(?:[\x00-\x7f]++'
+    rb'|[\xc2-\xdf][\x80-\xbf]'
+    rb'|\xe0[\xa0-\xbf][\x80-\xbf]'
+    rb'|[\xe1-\xec\xee\xef][\x80-\xbf]{2}'
+    rb'|\xed[\x80-\x9f][\x80-\xbf]'
+    rb'|\xf0[\x90-\xbf][\x80-\xbf]{2}'
+    rb'|[\xf1-\xf3][\x80-\xbf]{3}'
+    rb'|\xf4[\x80-\x8f][\x80-\xbf]{2})*+'
+)
+
+def find_invalid_utf8(stats, data, offset):
+    """
+    Record the byte offsets of invalid UTF-8 sequences in data.
+    offset is the position of data in the file. Whether the previous chunk
+    ended inside an invalid sequence is kept in stats, so a sequence cut by
+    a chunk boundary is still counted once.
+    """
+    if data.isascii():
+        stats['in_invalid_sequence'] = False
+        return
+    pos = 0
+    if stats.get('in_invalid_sequence'):
+        while pos < len(data) and data[pos] & 0xC0 == 0x80:
+            pos += 1
+    while pos < len(data):
+        pos = UTF8_VALID_RUN.match(data, pos).end()
+        if pos >= len(data):
+            stats['in_invalid_sequence'] = False
+            return
+        stats['invalid_count'] += 1
+        if len(stats['invalid_offsets']) < MAX_INVALID_OFFSETS:
+            stats['invalid_offsets'].append(offset + pos)
+        # Treat the bad byte and any continuation bytes after it as one sequence
+        pos += 1
+        while pos < len(data) and data[pos] & 0xC0 == 0x80:
+            pos += 1
+    stats['in_invalid_sequence'] = True
+
+def detect_encoding(head):
+    """
+    Pick the codec from the byte order mark at the start of the file.
+    Returns (encoding, length of the byte order mark).
+    """
+    if head.startswith(codecs.BOM_UTF32_LE) or head.startswith(codecs.BOM_UTF32_BE):
+        return 'utf-32', 4
+    if head.startswith(codecs.BOM_UTF8):
+        return 'utf-8-sig', 3
+    if head.startswith(codecs.BOM_UTF16_LE) or head.startswith(codecs.BOM_UTF16_BE):
+        return 'utf-16', 2
+    return 'utf-8', 0
+
+def compute_text_stats_bytes(filename, chunk_size=CHUNK_SIZE, count_bytes=None):
+    """
+    Count a UTF-8 file on its raw bytes without decoding it, using NumPy when
+    it is installed. Invalid UTF-8 is recorded by byte offset instead of
+    stopping the analysis. UTF-16 and UTF-32 files (detected from their byte
+    order mark) are decoded chunk by chunk instead, and so are compressed files.
+    """
+    if count_bytes is None:
+        count_bytes = count_bytes_numpy if np is not None else count_bytes_python
+
+    with open(filename, 'rb') as file:
+        head = file.read(6)
+        if detect_compression(head):
+            return compute_text_stats_compressed(filename, chunk_size=chunk_size)
+        encoding, bom_length = detect_encoding(head)
+        file.seek(0)
+        if encoding in ('utf-16', 'utf-32'):
+            stats = analyze_stream(file, chunk_size=chunk_size, encoding=encoding)
+            stats['encoding'] = encoding
+            return stats
+
+        stats = new_text_stats(with_lines=False)
+        stats['encoding'] = encoding
+        stats['invalid_count'] = 0
+        stats['invalid_offsets'] = []
+        stats['in_invalid_sequence'] = False
+
+        carried = b""
+        offset = file.seek(bom_length)
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            chunk = carried + chunk
+            cut = len(chunk) - split_incomplete_tail(chunk)
+            data, carried = chunk[:cut], chunk[cut:]
+            find_invalid_utf8(stats, data, offset)
+            count_bytes(stats, data)
+            offset += len(data)
+
+    # A character cut short by the end of the file
+    if carried:
+        find_invalid_utf8(stats, carried, offset)
+        count_bytes(stats, carried)
+
+    stats['lines'] = stats['newlines'] + 1
+    stats['sample'] = read_sample(filename, encoding=encoding)
+    return stats
+
+def count_block(file, offset, size):
+    """
+    Count one block for estimate mode. Words are counted by where they
+    start, so a word crossing into the next block belongs to this one only.
+    """
+    file.seek(max(offset - 1, 0))
+    data = file.read(size + 3 + (1 if offset else 0))
+    previous_is_space = True
+    if offset:
+        previous_is_space = data[0] in ASCII_WHITESPACE
+        data = data[1:]
+
+    # A character cut by the block start belongs to the previous block,
+    # and one cut by the block end is finished from the extra bytes
+    start = 0
+    while start < min(3, len(data)) and data[start] & 0xC0 == 0x80:
+        start += 1
+    end = min(size, len(data))
+    while end < len(data) and data[end] & 0xC0 == 0x80:
+        end += 1
+    text = data[start:end].decode('utf-8', errors='replace')
+
+    crlf_pairs = text.count('\r\n')
+    newlines = text.count('\n') + text.count('\r') - crlf_pairs
+    chars = len(text) - crlf_pairs
+    words = len(text.split())
+    if text and not text[0].isspace() and not previous_is_space:
+        words -= 1
+    return {
+        'lines': newlines,
+        'words': words,
+        'chars': chars,
+        'chars_no_whitespace': chars - newlines - text.count(' ') - text.count('\t'),
+    }
+
+def estimate_text_stats(filename, max_error=None, seed=None, budget=ESTIMATE_BUDGET,
+                        block_size=ESTIMATE_BLOCK_SIZE, exact_fallback=True):
+    """
+    Estimate the totals of a large file from randomly chosen blocks, reading
+    at most 'budget' bytes. Each total comes with a 95% confidence interval
+    in stats['estimate']. The same seed always picks the same blocks.
+    When max_error (e.g. 0.01 for 1%) is not met by every interval and
+    exact_fallback is set, the file is scanned exactly instead.
+    """
+    file_size = os.path.getsize(filename)
+    with open(filename, 'rb') as file:
+        compressed = detect_compression(file.read(6))
+
+    block_count = file_size // block_size
+    sample_count = min(budget // block_size, block_count)
+    if compressed or sample_count < 2 or sample_count * block_size >= file_size:
+        # Small or compressed files cannot usefully be sampled
+        stats = compute_text_stats(filename)
+        stats['estimate_method'] = 'exact'
+        return stats
+
+    rng = random.Random(seed)
+    blocks = sorted(rng.sample(range(block_count), sample_count))
+    with open(filename, 'rb') as file:
+        counts = [count_block(file, block * block_size, block_size) for block in blocks]
+
+    # Blocks only cover block_count * block_size bytes; scale per byte to the whole file
+    scale = file_size / block_size
+    finite_population = 1 - sample_count / block_count
+    stats = new_text_stats(with_lines=False)
+    stats['estimate'] = {}
+    for key in ('lines', 'words', 'chars', 'chars_no_whitespace'):
+        values = [count[key] for count in counts]
+        mean = sum(values) / sample_count
+        variance = sum((value - mean) ** 2 for value in values) / (sample_count - 1)
+        margin = CONFIDENCE_Z * scale * math.sqrt(variance / sample_count * finite_population)
+        total = mean * scale + (1 if key == 'lines' else 0)
+        stats[key] = round(total)
+        stats['estimate'][key] = (max(0, round(total - margin)), round(total + margin))
+    stats['newlines'] = stats['lines'] - 1
+
+    if max_error is not None and exact_fallback:
+        for key in ('lines', 'words', 'chars'):
+            low, high = stats['estimate'][key]
+            if stats[key] and (high - low) / 2 > max_error * stats[key]:
+                stats = compute_text_stats(filename)
+                stats['estimate_method'] = 'exact'
+                stats['estimate_bytes_read'] = sample_count * block_size
+                return stats
+
+    stats['estimate_method'] = 'sampled'
+    stats['estimate_blocks'] = sample_count
+    stats['estimate_bytes_read'] = sample_count * block_size
+    stats['sample'] = read_sample(filename)
+    return stats
+
+def follow_text_stats(filename, interval=1.0, chunk_size=CHUNK_SIZE):
+    """
+    Keep the file open and yield (stats, event, new_bytes) whenever it changes.
+    Only bytes appended since the last poll are read. event is 'start',
+    'appended', 'truncated' or 'rotated'; after the last two the totals
+    start again from the beginning of the (new) file.
+    """
+    file = open(filename, 'rb')
+    try:
+        stats = new_text_stats()
+        decoder = make_decoder()
+        position = 0
+        event = 'start'
+
+        while True:
+            new_bytes = 0
+            for chunk in iter(lambda: file.read(chunk_size), b""):
+                update_text_stats(stats, decoder.decode(chunk))
+                new_bytes += len(chunk)
+            position += new_bytes
+
+            try:
+                rotated = os.stat(filename).st_ino != os.fstat(file.fileno()).st_ino
+            except FileNotFoundError:
+                # Renamed away and not recreated yet, keep reading the old file
+                rotated = False
+
+            if rotated or os.fstat(file.fileno()).st_size < position:
+                if rotated:
+                    file.close()
+                    file = open(filename, 'rb')
+                    event = 'rotated'
+                else:
+                    file.seek(0)
+                    event = 'truncated'
+                stats = new_text_stats()
+                decoder = make_decoder()
+                new_bytes = 0
+                for chunk in iter(lambda: file.read(chunk_size), b""):
+                    update_text_stats(stats, decoder.decode(chunk))
+                    new_bytes += len(chunk)
+                position = new_bytes
+
+            if event or new_bytes:
+                stats['lines'] = stats['newlines'] + 1
+                yield stats, event or 'appended', new_bytes
+                event = None
+
+            time.sleep(interval)
+    finally:
+        file.close()
+
+def print_analysis_results(filename, stats):
+    line_count = stats['lines']
+    word_count = stats['words']
+    char_count = stats['chars']
+    char_count_no_whitespace = stats['chars_no_whitespace']
+
+    print("\n" + "=" * 50)
+    print(f"ANALYSIS RESULTS for '{filename}':")
+    print("=" * 50)
+    print(f"Lines: {line_count}")
+    print(f"Words: {word_count}")
+    print(f"Characters (including spaces): {char_count}")
+    print(f"Characters (excluding whitespace): {char_count_no_whitespace}")
+    
+    print("\nAdditional Statistics:")
+    print("-" * 30)
+    
+    if line_count > 0:
+        avg_words_per_line = word_count / line_count
+        print(f"Average words per line: {avg_words_per_line:.2f}")
+    
+    if word_count > 0:
+        avg_chars_per_word = char_count_no_whitespace / word_count
+        print(f"Average characters per word: {avg_chars_per_word:.2f}")
+    
+    if os.path.exists(filename):
+        file_size = os.path.getsize(filename)
+        print(f"File size: {file_size} bytes")
+
+    if 'encoding' in stats:
+        print(f"Encoding: {stats['encoding']}")
+
+    if 'top_words' in stats:
+        print(f"\nMost common words (approximate, top {TOP_WORDS_SHOWN}):")
+        print("-" * 30)
+        for word, count, lowest in stats['top_words']:
+            display_word = word[:40] + "..." if len(word) > 40 else word
+            if lowest == count:
+                print(f"  {display_word}: {count}")
+            else:
+                print(f"  {display_word}: between {lowest} and {count}")
+        relative_error = 1.04 / math.sqrt(1 << HLL_PRECISION)
+        print(f"Distinct words: about {stats['distinct_words']} (within ±{relative_error:.1%} typically)")
+
+    if 'line_lengths' in stats:
+        report = line_length_report(stats['line_lengths'])
+        print("\nLine lengths (p50 / p95 / p99 / longest):")
+        print("-" * 30)
+        for key, unit in (('bytes', 'bytes'), ('words', 'words')):
+            values = " / ".join(str(report[key][percentile]) for percentile in LINE_PERCENTILES)
+            print(f"  In {unit}: {values} / {report[key]['max']}")
+
+    if stats.get('estimate_method') == 'sampled':
+        print(f"\nEstimated from {stats['estimate_blocks']} random blocks "
+              f"({stats['estimate_bytes_read']} bytes read), 95% confidence:")
+        for key, label in (('lines', 'Lines'), ('words', 'Words'), ('chars', 'Characters')):
+            low, high = stats['estimate'][key]
+            print(f"  {label}: {low} to {high}")
+    elif stats.get('estimate_method') == 'exact':
+        print("Exact counts (the file was too small or the requested error too tight to sample)")
+
+    if stats.get('compression'):
+        ratio = stats['uncompressed_bytes'] / max(stats['compressed_bytes'], 1)
+        print(f"Compression: {stats['compression']} ({stats['compressed_bytes']} bytes compressed, "
+              f"{stats['uncompressed_bytes']} bytes uncompressed, {ratio:.1f}x)")
+
+    if stats.get('cache_status') == 'hit':
+        print("Cache: file unchanged, stored result reused")
+    elif stats.get('cache_status') == 'appended':
+        print(f"Cache: only the {stats['appended_bytes']} appended bytes were read")
+
+    if stats.get('invalid_count'):
+        offsets = ", ".join(str(offset) for offset in stats['invalid_offsets'])
+        if stats['invalid_count'] > len(stats['invalid_offsets']):
+            offsets += ", ..."
+        print(f"Invalid UTF-8 sequences: {stats['invalid_count']} (at byte offsets {offsets})")
+    
+    print("\nSample of file content (first 3 lines):")
+    print("-" * 30)
+    for i, line in enumerate(stats['sample'][:SAMPLE_LINES]):
+        if line:
+            display_line = line[:SAMPLE_WIDTH] + "..." if len(line) > SAMPLE_WIDTH else line
+            print(f"Line {i+1}: {display_line}")
+    
+    if line_count > SAMPLE_LINES:
+        print(f"... and {line_count-SAMPLE_LINES} more lines")
+
+def analyze_file(mode="stream"):
+    """
+    mode "stream" reads the file in one pass; "parallel" splits it across CPU cores;
+    "bytes" counts the raw bytes without decoding them; "words" also reports
+    the most common words and the number of distinct words; "lines" also
+    reports line length percentiles; "estimate" samples random blocks of a
+    very large file.
+    """
     print("=" * 50)
     print("TEXT FILE ANALYZER")
     print("=" * 50)
@@ -15,58 +1434,33 @@ def analyze_file():
     filename = input("Enter the filename to analyze (e.g., 'spooky_story.txt'): ").strip()
     
     try:
-        with open(filename, 'r', encoding='utf-8') as file:
-            content = file.read()
-        
-        lines = content.split('\n')
-        line_count = len(lines)
-        
-        words = content.split()
-        word_count = len(words)
-
-        char_count = len(content)
-
-        char_count_no_whitespace = len(content.replace(' ', '').replace('\n', '').replace('\t', ''))
-        
-        print("\n" + "=" * 50)
-        print(f"ANALYSIS RESULTS for '{filename}':")
-        print("=" * 50)
-        print(f"Lines: {line_count}")
-        print(f"Words: {word_count}")
-        print(f"Characters (including spaces): {char_count}")
-        print(f"Characters (excluding whitespace): {char_count_no_whitespace}")
-        
-        print("\nAdditional Statistics:")
-        print("-" * 30)
-        
-        if line_count > 0:
-            avg_words_per_line = word_count / line_count
-            print(f"Average words per line: {avg_words_per_line:.2f}")
-        
-        if word_count > 0:
-            avg_chars_per_word = char_count_no_whitespace / word_count
-            print(f"Average characters per word: {avg_chars_per_word:.2f}")
-        
-        import os
-        if os.path.exists(filename):
-            file_size = os.path.getsize(filename)
-            print(f"File size: {file_size} bytes")
-        
-        print("\nSample of file content (first 3 lines):")
-        print("-" * 30)
-        for i, line in enumerate(lines[:3]):
-            if line:
-                display_line = line[:80] + "..." if len(line) > 80 else line
-                print(f"Line {i+1}: {display_line}")
-        
-        if len(lines) > 3:
-            print(f"... and {len(lines)-3} more lines")
+        if mode == "parallel":
+            workers = input(f"Number of worker processes (Enter for {os.cpu_count()}): ").strip()
+            stats = compute_text_stats_parallel(filename, int(workers) if workers else None)
+        elif mode == "words":
+            stats = compute_text_stats_parallel(filename, with_words=True)
+        elif mode == "lines":
+            stats = compute_text_stats_parallel(filename, with_lines=True)
+        elif mode == "estimate":
+            max_error = input("Largest acceptable error in % (Enter for no limit): ").strip()
+            seed = input("Random seed for repeatable results (Enter for a random one): ").strip()
+            stats = estimate_text_stats(filename,
+                                        float(max_error) / 100 if max_error else None,
+                                        int(seed) if seed else None)
+        elif mode == "bytes":
+            if np is None:
+                print("NumPy is not installed - using the pure Python byte counter.")
+            stats = compute_text_stats_bytes(filename)
+        else:
+            cache = load_cache()
+            stats = compute_text_stats_cached(filename, cache)
+            save_cache(cache)
+        print_analysis_results(filename, stats)
             
     except FileNotFoundError:
         print(f"\nERROR: File '{filename}' not found.")
         print("Please make sure the file exists in the current directory.")
         print("\nAvailable text files in current directory:")
-        import glob
         text_files = glob.glob("*.txt")
         if text_files:
             for file in text_files:
@@ -77,10 +1471,99 @@ def analyze_file():
     except UnicodeDecodeError:
         print(f"\nERROR: Unable to read '{filename}' as a text file.")
         print("The file may be binary or use a different encoding.")
+        print("Choose 'Analyze raw bytes' from the menu to find the invalid sequences.")
         
     except Exception as e:
         print(f"\nERROR: An unexpected error occurred: {e}")
 
+def follow_file():
+    """
+    Watch a log file that is still being written and print updated totals.
+    """
+    print("=" * 50)
+    print("FOLLOW A GROWING FILE")
+    print("=" * 50)
+
+    filename = input("Enter the filename to follow: ").strip()
+    interval = input("Seconds between checks (Enter for 1): ").strip()
+
+    try:
+        interval = float(interval) if interval else 1.0
+        print("\nPress Ctrl+C to stop.\n")
+        for stats, event, new_bytes in follow_text_stats(filename, interval):
+            if event == 'truncated':
+                print("File was truncated - counting again from the start.")
+            elif event == 'rotated':
+                print("File was replaced (log rotation) - counting the new file.")
+            print(f"{time.strftime('%H:%M:%S')}  Lines: {stats['lines']}  Words: {stats['words']}  "
+                  f"Characters: {stats['chars']}  (+{new_bytes} bytes)")
+
+    except KeyboardInterrupt:
+        print("\nStopped following.")
+    except FileNotFoundError:
+        print(f"\nERROR: File '{filename}' not found.")
+    except UnicodeDecodeError:
+        print(f"\nERROR: Unable to read '{filename}' as a UTF-8 text file.")
+    except ValueError:
+        print("\nERROR: Please enter the interval as a number of seconds.")
+    except Exception as e:
+        print(f"\nERROR: An unexpected error occurred: {e}")
+
+def analyze_corpus():
+    """
+    Analyze every file matching some globs or inside some directories,
+    printing one row per file as it finishes and the grand totals at the end.
+    """
+    print("\n" + "=" * 50)
+    print("ANALYZE MANY FILES")
+    print("=" * 50)
+
+    patterns_input = input("Enter files, globs (e.g. 'logs/**/*.txt') or directories, separated by spaces: ").strip()
+    patterns = [p for p in re.split(r'[,\s]+', patterns_input) if p]
+    filenames = expand_corpus(patterns)
+
+    if not filenames:
+        print("No files matched.")
+        return
+
+    workers = input(f"Number of worker processes (Enter for {os.cpu_count()}): ").strip()
+    try:
+        workers = int(workers) if workers else None
+    except ValueError:
+        print("Please enter a valid number.")
+        return
+
+    totals = {'lines': 0, 'words': 0, 'chars': 0, 'bytes': 0}
+    failed = []
+    start_time = time.time()
+
+    print(f"\nAnalyzing {len(filenames)} files...\n")
+    print(f"{'Lines':>10} {'Words':>12} {'Characters':>14}  File")
+    print("-" * 50)
+    for filename, stats, error in analyze_corpus_files(filenames, workers):
+        if error is not None:
+            print(f"{'ERROR':>10} {'':>12} {'':>14}  {filename}: {error}")
+            failed.append(filename)
+            continue
+        print(f"{stats['lines']:>10} {stats['words']:>12} {stats['chars']:>14}  {filename}")
+        for key in ('lines', 'words', 'chars'):
+            totals[key] += stats[key]
+        totals['bytes'] += os.path.getsize(filename)
+
+    elapsed = time.time() - start_time
+    print("-" * 50)
+    print(f"{totals['lines']:>10} {totals['words']:>12} {totals['chars']:>14}  TOTAL")
+
+    print("\n" + "=" * 50)
+    print("CORPUS SUMMARY")
+    print("=" * 50)
+    print(f"Total files: {len(filenames)}")
+    print(f"Successfully analyzed: {len(filenames) - len(failed)}")
+    print(f"Failed: {len(failed)}")
+    print(f"Total size: {totals['bytes']} bytes")
+    if elapsed > 0:
+        print(f"Time: {elapsed:.2f} s ({totals['bytes'] / elapsed / 1e6:.1f} MB/s)")
+
 def analyze_specific_files():
     """
     Optional function to analyze the specific text files provided
@@ -96,17 +1579,14 @@ def analyze_specific_files():
         "capybara_facts.txt"
     ]
     
+    cache = load_cache()
     for filename in files_to_analyze:
         try:
-            with open(filename, 'r', encoding='utf-8') as file:
-                content = file.read()
-            
-            lines = content.split('\n')
-            words = content.split()
+            stats = compute_text_stats_cached(filename, cache)
             
-            line_count = len(lines)
-            word_count = len(words)
-            char_count = len(content)
+            line_count = stats['lines']
+            word_count = stats['words']
+            char_count = stats['chars']
             
             print(f"\n{filename}:")
             print(f"  Lines: {line_count}")
@@ -122,6 +1602,7 @@ def analyze_specific_files():
             print(f"\n{filename}: File not found")
         except Exception as e:
             print(f"\n{filename}: Error - {e}")
+    save_cache(cache)
 
 def main():
     """
@@ -132,21 +1613,46 @@ def main():
         print("TEXT FILE ANALYZER - MAIN MENU")
         print("=" * 50)
         print("1. Analyze any text file")
-        print("2. Analyze specific provided files (giraffe_facts.txt, etc.)")
-        print("3. Exit")
+        print("2. Analyze a very large file using all CPU cores")
+        print("3. Analyze raw bytes without decoding (uses NumPy if installed)")
+        print("4. Word frequency report (top words and distinct words)")
+        print("5. Quick estimate for a huge file (random sampling)")
+        print("6. Analyze many files (globs or directories) in parallel")
+        print("7. Analyze specific provided files (giraffe_facts.txt, etc.)")
+        print("8. Follow a log file as it grows")
+        print("9. Clear the analysis cache")
+        print("10. Line length report (percentiles in bytes and words)")
+        print("11. Exit")
         print("-" * 30)
         
-        choice = input("Enter your choice (1-3): ").strip()
+        choice = input("Enter your choice (1-11): ").strip()
         
         if choice == "1":
             analyze_file()
         elif choice == "2":
-            analyze_specific_files()
+            analyze_file("parallel")
         elif choice == "3":
+            analyze_file("bytes")
+        elif choice == "4":
+            analyze_file("words")
+        elif choice == "5":
+            analyze_file("estimate")
+        elif choice == "6":
+            analyze_corpus()
+        elif choice == "7":
+            analyze_specific_files()
+        elif choice == "8":
+            follow_file()
+        elif choice == "9":
+            clear_cache()
+            print("\nCache cleared.")
+        elif choice == "10":
+            analyze_file("lines")
+        elif choice == "11":
             print("\nThank you for using Text File Analyzer. Goodbye!")
             break
         else:
-            print("\nInvalid choice. Please enter 1, 2, or 3.")
+            print("\nInvalid choice. Please enter a number between 1 and 11.")
         
         input("\nPress Enter to continue...")
 